@@ -0,0 +1,47 @@
+"""Measure start-up time of the ccib entry points.
+
+Run from the repository root:
+
+    python benchmarks/startup.py [--runs N]
+
+Each command runs in a fresh interpreter; the median, best and worst wall-clock
+times are reported. The baseline row is a bare interpreter start for reference.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+COMMANDS = [
+    ('python -c pass (baseline)', ['-c', 'pass']),
+    ('python -m ccib --help', ['-m', 'ccib', '--help']),
+    ('import ccib.__main__', ['-c', 'import ccib.__main__']),
+    ('import falconpy', ['-c', 'import falconpy']),
+    ('import google.auth.transport.requests', ['-c', 'import google.auth.transport.requests']),
+]
+
+
+def measure(args, runs):
+    """Return the wall-clock durations (in milliseconds) of running the interpreter with args."""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], capture_output=True, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help='number of runs per command (default: 10)')
+    args = parser.parse_args()
+
+    print(f"{'command':<42} {'median':>9} {'min':>9} {'max':>9}")
+    for name, cmd in COMMANDS:
+        timings = measure(cmd, args.runs)
+        print(f"{name:<42} {statistics.median(timings):>7.1f}ms {min(timings):>7.1f}ms {max(timings):>7.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
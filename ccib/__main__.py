@@ -1,14 +1,40 @@
-from queue import Queue
+import argparse
+import tracemalloc
 from .falcon import FalconAPI
-from .config import config
-from .log import log
+from .config import get_config
+from .log import log, setup_logging
+from .budget import IngestionBudget
 from .chronicle import Chronicle
+from .icache import ICache
+from .lanes import LaneQueue
+from .profiling import Profiler, install_signal_handlers, start_http_endpoint
+from .shards import ShardCoordinator, ShardLeaseThread, install_release_handler
 from .state import load_state
 from .threads import FalconReaderThread, ChronicleWriterThread
+from .tracing import Tracer
 from . import __version__
 
+# The writer sends one request at a time; the Chronicle connection pool is sized to match by default
+WRITER_THREADS = 1
+
+
+def parse_args(argv=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        prog='ccib',
+        description='CrowdStrike Chronicle Intel Bridge: forwards CrowdStrike Falcon Intelligence Indicators to Chronicle. '
+                    'Configuration is read from config/*.ini and environment variables.')
+    parser.add_argument('--version', action='version', version=f'%(prog)s {__version__}')
+    return parser.parse_args(argv)
+
+
+def main():
+    """Start the bridge."""
+    parse_args()
+
+    config = get_config()
+    setup_logging(config.get('logging', 'level'))
 
-if __name__ == "__main__":
     log.info("Starting CrowdStrike Chronicle Intel Bridge %s", __version__)
     log.debug("Log level set to: %s", config.get('logging', 'level'))
 
@@ -17,23 +43,65 @@ if __name__ == "__main__":
     falcon = FalconAPI()
     log.debug("Falcon API client initialized with cloud region: %s", config.get('falcon', 'cloud_region'))
 
-    queue = Queue(maxsize=10)
-    log.debug("Created thread-safe queue with max size: 10")
+    queue = LaneQueue.from_config(config, maxsize=10)
+    log.debug("Created lane queue with max size per lane: 10, weights: %s", queue.weights)
 
-    chronicle = Chronicle(config.get('chronicle', 'customer_id'), config.get('chronicle', 'service_account'), config.get('chronicle', 'region'))
+    chronicle = Chronicle(config.get('chronicle', 'customer_id'), config.get('chronicle', 'service_account'), config.get('chronicle', 'region'),
+                          pool_size=int(config.get('chronicle', 'pool_size')) or WRITER_THREADS,
+                          token_refresh_margin=int(config.get('chronicle', 'token_refresh_margin')),
+                          max_idle=int(config.get('chronicle', 'max_idle')),
+                          ingestion_api=config.get('chronicle', 'ingestion_api'),
+                          project_id=config.get('chronicle', 'project_id'),
+                          instance=config.get('chronicle', 'instance'),
+                          batch_size=int(config.get('chronicle', 'batch_size')),
+                          compress=config.getboolean('chronicle', 'compress'),
+                          endpoint=config.get('chronicle', 'endpoint'))
     log.debug("Chronicle client initialized with customer ID: %s, region: %s",
               config.get('chronicle', 'customer_id'),
               config.get('chronicle', 'region') or "US (default)")
 
-    saved_state = load_state()
-    resume_marker = saved_state.get('last_marker') if saved_state else None
-    if resume_marker is not None:
-        log.info("Resuming from saved marker: %s", resume_marker)
+    icache = ICache.from_config(config)
+    budget = IngestionBudget.from_config(config)
+
+    if config.getboolean('profiling', 'tracemalloc'):
+        log.info("Tracing memory allocations with tracemalloc")
+        tracemalloc.start()
+    profiler = Profiler(config.get('profiling', 'output_dir'),
+                        duration=int(config.get('profiling', 'duration')),
+                        top=int(config.get('profiling', 'top')))
+    install_signal_handlers(profiler)
+    if int(config.get('profiling', 'port')):
+        start_http_endpoint(profiler, int(config.get('profiling', 'port')))
+
+    tracer = Tracer.from_config(config)
+
+    coordinator = None
+    resume_marker = None
+    if int(config.get('sharding', 'shards')):
+        coordinator = ShardCoordinator(config.get('sharding', 'coordinator'), int(config.get('sharding', 'shards')),
+                                       replica_id=config.get('sharding', 'replica_id'),
+                                       lease_ttl=int(config.get('sharding', 'lease_ttl')))
+        coordinator.claim()
+        log.info("Sharding enabled, resuming from per-shard markers in %s", coordinator.path)
+        log.debug("Starting Shard Lease Thread")
+        ShardLeaseThread(coordinator).start()
+        install_release_handler(coordinator)
     else:
-        log.info("No saved state, will use initial_sync_lookback")
+        saved_state = load_state()
+        resume_marker = saved_state.get('last_marker') if saved_state else None
+        if resume_marker is not None:
+            log.info("Resuming from saved marker: %s", resume_marker)
+        else:
+            log.info("No saved state, will use initial_sync_lookback")
 
     log.debug("Starting Falcon Reader Thread")
-    FalconReaderThread(falcon, queue, resume_marker=resume_marker).start()
+    FalconReaderThread(falcon, queue, icache, resume_marker=resume_marker, profiler=profiler, coordinator=coordinator,
+                       budget=budget, tracer=tracer).start()
 
     log.debug("Starting Chronicle Writer Thread")
-    ChronicleWriterThread(queue, chronicle).start()
+    ChronicleWriterThread(queue, chronicle, icache=icache, profiler=profiler, coordinator=coordinator,
+                          budget=budget, tracer=tracer).start()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import datetime
+import threading
+import time
+from collections import deque
+from .log import log
+
+
+class TokenBucket:
+    """Token bucket refilled at a constant rate, holding at most one second worth of tokens.
+
+    A request larger than the bucket is let through once the bucket is full and
+    leaves it in debt, so the average rate still holds.
+    """
+    def __init__(self, rate, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = rate
+        self.tokens = rate
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Return the number of seconds until amount tokens can be taken."""
+        self._refill()
+        missing = min(amount, self.capacity) - self.tokens
+        return max(missing / self.rate, 0)
+
+    def take(self, amount):
+        """Take amount tokens."""
+        self._refill()
+        self.tokens -= amount
+
+
+class IngestionBudget:  # pylint: disable=R0902
+    """Limits the requests and bytes sent to Chronicle.
+
+    acquire() blocks the writer until the request fits into the per-second limits
+    and the daily byte cap (reset at midnight UTC). The queue then fills up and the
+    reader waits as well, so nothing gets dropped. A limit of 0 means unlimited.
+    """
+    RATE_WINDOW = 60
+
+    def __init__(self, requests_per_second=0, bytes_per_second=0, daily_bytes=0, clock=time.monotonic, sleep=time.sleep):
+        self.requests = TokenBucket(requests_per_second, clock) if requests_per_second else None
+        self.bytes = TokenBucket(bytes_per_second, clock) if bytes_per_second else None
+        self.daily_bytes = daily_bytes
+        self.clock = clock
+        self.sleep = sleep
+        self.day = self._today()
+        self.sent_today = 0
+        self.throttled = 0.0
+        self._recent = deque()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a budget from the [budget] configuration section."""
+        return cls(requests_per_second=float(config.get('budget', 'requests_per_second')),
+                   bytes_per_second=float(config.get('budget', 'bytes_per_second')),
+                   daily_bytes=int(float(config.get('budget', 'daily_bytes'))))
+
+    @staticmethod
+    def _today():
+        return datetime.datetime.now(datetime.timezone.utc).date()
+
+    @staticmethod
+    def _seconds_until_tomorrow():
+        now = datetime.datetime.now(datetime.timezone.utc)
+        tomorrow = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time(),
+                                             tzinfo=datetime.timezone.utc)
+        return (tomorrow - now).total_seconds()
+
+    def _wait_time(self, nbytes):
+        if self._today() != self.day:
+            self.day = self._today()
+            self.sent_today = 0
+        if self.daily_bytes and self.sent_today + nbytes > self.daily_bytes and self.sent_today > 0:
+            return self._seconds_until_tomorrow()
+        wait = 0
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1))
+        if self.bytes is not None:
+            wait = max(wait, self.bytes.wait_time(nbytes))
+        return wait
+
+    def acquire(self, nbytes):
+        """Block until a request of nbytes fits into the budget, then account for it."""
+        while True:
+            with self._lock:
+                wait = self._wait_time(nbytes)
+                if wait <= 0:
+                    self._take(nbytes)
+                    return
+                self.throttled += wait
+            if wait > 60:
+                log.warning("Daily Chronicle ingestion budget of %d bytes used up, pausing for %d seconds",
+                            self.daily_bytes, wait)
+            else:
+                log.debug("Ingestion budget exhausted, waiting %.2f seconds", wait)
+            self.sleep(wait)
+
+    def _take(self, nbytes):
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.bytes is not None:
+            self.bytes.take(nbytes)
+        self.sent_today += nbytes
+        self._recent.append((self.clock(), nbytes))
+
+    def get_stats(self):
+        """Return the rate over the last minute and the remaining daily budget."""
+        with self._lock:
+            cutoff = self.clock() - self.RATE_WINDOW
+            while self._recent and self._recent[0][0] < cutoff:
+                self._recent.popleft()
+            stats = {
+                'requests_per_second': round(len(self._recent) / self.RATE_WINDOW, 2),
+                'bytes_per_second': round(sum(n for _, n in self._recent) / self.RATE_WINDOW),
+                'throttled_seconds': round(self.throttled, 1),
+            }
+            if self.daily_bytes:
+                stats['daily_bytes_remaining'] = max(self.daily_bytes - self.sent_today, 0)
+            return stats
@@ -1,93 +1,279 @@
 # Imports required for the sample - Google Auth and API Client Library Imports.
 # Get these packages from https://pypi.org/project/google-api-python-client/ or
 # run $ pip install google-api-python-client from your terminal
+import base64
 import datetime
+import gzip
 import json
-from google.auth.transport import requests
-from google.oauth2 import service_account
+import threading
+import time
 from .log import log
 
 
-class Chronicle:
-    """Chronicle API client."""
+def build_session(credentials, pool_size):
+    """Build an authorized HTTP session with a connection pool sized for the writers.
+
+    Retries are left to the writer thread, so the adapter itself never retries.
+    """
+    from google.auth.transport import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.AuthorizedSession(credentials)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    session.mount('https://', adapter)
+    return session
+
+
+class TokenRefresherThread(threading.Thread):
+    """Thread that refreshes the OAuth token before it expires.
+
+    Keeps token refresh off the send path: the writer thread only ever sees a valid token.
+    """
+    MIN_SLEEP = 5
+    RETRY_DELAY = 30
+
+    def __init__(self, credentials, margin, *args, **kwargs):
+        super().__init__(*args, daemon=True, **kwargs)
+        self.credentials = credentials
+        self.margin = margin
+
+    def seconds_until_refresh(self):
+        """Return number of seconds until the token should be refreshed."""
+        expiry = self.credentials.expiry
+        if expiry is None:
+            return 0
+        # google-auth stores expiry as naive UTC datetime
+        remaining = (expiry - datetime.datetime.utcnow()).total_seconds()
+        return max(remaining - self.margin, 0)
+
+    def refresh(self):
+        """Refresh the OAuth token."""
+        from google.auth.transport import requests
+
+        # Replacing the token is a plain attribute swap, so the writer can keep sending meanwhile
+        self.credentials.refresh(requests.Request())
+        log.debug("OAuth token refreshed, valid until %s", self.credentials.expiry)
+
+    def run(self):
+        log.debug("Starting TokenRefresherThread (margin: %d seconds)", self.margin)
+        while True:
+            delay = self.seconds_until_refresh()
+            if delay > 0:
+                time.sleep(max(delay, self.MIN_SLEEP))
+                continue
+            try:
+                self.refresh()
+            except Exception:  # pylint: disable=W0703
+                log.exception("Could not refresh OAuth token, retrying in %d seconds", self.RETRY_DELAY)
+                time.sleep(self.RETRY_DELAY)
+
+
+def encode_body(body, compress=False):
+    """Serialize a request body to JSON bytes, gzip-compressed if requested."""
+    payload = json.dumps(body).encode()
+    return gzip.compress(payload, compresslevel=6) if compress else payload
+
+
+def _rfc3339(ts_epoch_microseconds):
+    return datetime.datetime.fromtimestamp(ts_epoch_microseconds / 1_000_000, datetime.timezone.utc) \
+        .strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+class BatchCreateBackend:
+    """Legacy ingestion API: v2 unstructuredlogentries:batchCreate."""
+    NAME = 'batchcreate'
     OAUTH2_SCOPES = ['https://www.googleapis.com/auth/chronicle-backstory',
                      'https://www.googleapis.com/auth/malachite-ingestion']
+    # Chronicle has a limit of 250 indicators and 1 MB per request
+    MAX_ENTRIES = 250
+    MAX_BYTES = 1_000_000
+
+    # https://cloud.google.com/chronicle/docs/reference/search-api#regional_endpoints
+    # https://cloud.google.com/chronicle/docs/reference/ingestion-api#regional_endpoints
+    # Map of region codes to their endpoints
+    REGION_ENDPOINTS = {
+        # Legacy region codes
+        "EU": "https://europe-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
+        "UK": "https://europe-west2-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
+        "IL": "https://me-west1-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
+        "AU": "https://australia-southeast1-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
+        "SG": "https://asia-southeast1-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
+
+        # New region codes based on Google Cloud regions
+        "US": "https://malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
+        "EUROPE": "https://europe-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
+        "EUROPE-WEST2": "https://europe-west2-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
+        "EUROPE-WEST3": "https://europe-west3-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
+        "EUROPE-WEST6": "https://europe-west6-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
+        "EUROPE-WEST9": "https://europe-west9-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
+        "EUROPE-WEST12": "https://europe-west12-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
+        "ME-WEST1": "https://me-west1-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
+        "ME-CENTRAL1": "https://me-central1-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
+        "ME-CENTRAL2": "https://me-central2-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
+        "ASIA-SOUTH1": "https://asia-south1-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
+        "ASIA-SOUTHEAST1": "https://asia-southeast1-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
+        "ASIA-NORTHEAST1": "https://asia-northeast1-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
+        "AUSTRALIA-SOUTHEAST1": "https://australia-southeast1-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
+        "SOUTHAMERICA-EAST1": "https://southamerica-east1-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
+        "NORTHAMERICA-NORTHEAST2": "https://northamerica-northeast2-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
+    }
+
+    def __init__(self, customer_id, region):
+        self.customer_id = customer_id
+        # Default to US multi-region if region is not specified or not recognized
+        self.endpoint = self.REGION_ENDPOINTS.get(region, self.REGION_ENDPOINTS['US'])
+
+    def entry(self, log_text, ts_epoch_microseconds):
+        """Return the request entry for one serialized indicator."""
+        return {
+            "log_text": log_text,
+            "ts_epoch_microseconds": ts_epoch_microseconds
+        }
+
+    def body(self, entries):
+        """Return the request body for a batch of entries."""
+        return {
+            'customer_id': self.customer_id,
+            'log_type': "CROWDSTRIKE_IOC",
+            'entries': entries,
+        }
+
+
+class LogsImportBackend:
+    """Chronicle (SecOps) v1alpha logs:import API, accepting larger inline batches."""
+    NAME = 'logs_import'
+    OAUTH2_SCOPES = ['https://www.googleapis.com/auth/cloud-platform']
+    MAX_ENTRIES = 4000
+    MAX_BYTES = 4_000_000
+
+    # Legacy region codes map to the Google Cloud location of the same instance
+    LOCATIONS = {"EU": "europe", "UK": "europe-west2", "IL": "me-west1", "AU": "australia-southeast1",
+                 "SG": "asia-southeast1"}
+
+    def __init__(self, customer_id, region, project_id, instance=None):
+        location = self.LOCATIONS.get(region, (region or "US").lower())
+        parent = f'projects/{project_id}/locations/{location}/instances/{instance or customer_id}'
+        self.endpoint = (f'https://{location}-chronicle.googleapis.com/v1alpha/{parent}'
+                         '/logTypes/CROWDSTRIKE_IOC/logs:import')
+
+    def entry(self, log_text, ts_epoch_microseconds):
+        """Return the request entry for one serialized indicator."""
+        return {
+            "data": base64.b64encode(log_text.encode()).decode(),
+            "logEntryTime": _rfc3339(ts_epoch_microseconds),
+            "collectionTime": _rfc3339(time.time_ns() // 1000),
+        }
+
+    def body(self, entries):
+        """Return the request body for a batch of entries."""
+        return {'inlineSource': {'logs': entries}}
+
+
+class Chronicle:  # pylint: disable=R0902,R0913
+    """Chronicle API client.
+
+    Requests are built by the ingestion backend: the legacy batchCreate API by
+    default, or the v1alpha logs:import API with its larger batches. Both share
+    the serialization and optional gzip compression done here.
+    """
+    def __init__(self, customer_id, service_account_file, region, *, pool_size=1, token_refresh_margin=600, max_idle=240,
+                 ingestion_api='batchcreate', project_id=None, instance=None, batch_size=0, compress=False,
+                 endpoint=None):
+        from google.oauth2 import service_account
 
-    def __init__(self, customer_id, service_account_file, region):
         self.customer_id = customer_id
         self.region = region
+        self.pool_size = pool_size
+        self.max_idle = max_idle
+        self.compress = compress
+        self._last_used = time.monotonic()
         log.debug("Initializing Chronicle client with customer ID: %s, region: %s",
                   customer_id, region or "not specified (will default to US)")
 
+        # Make region case-insensitive
+        region_upper = self.region.upper() if self.region else ""
+        log.debug("Using region (uppercase): %s", region_upper or "empty (will default to US)")
+        if ingestion_api == LogsImportBackend.NAME:
+            self.backend = LogsImportBackend(customer_id, region_upper, project_id, instance)
+        else:
+            self.backend = BatchCreateBackend(customer_id, region_upper)
+        self.batch_size = min(batch_size, self.backend.MAX_ENTRIES) if batch_size else self.backend.MAX_ENTRIES
+
         # Create a credential using Google Developer Service Account Credential and Chronicle # API Scope.
         log.debug("Loading service account credentials from: %s", service_account_file)
         self.credentials = service_account.Credentials.from_service_account_file(
-            service_account_file, scopes=self.OAUTH2_SCOPES)
+            service_account_file, scopes=self.backend.OAUTH2_SCOPES)
         log.debug("Service account credentials loaded successfully")
 
         # Build an HTTP session to make authorized OAuth requests.
-        self.http_session = requests.AuthorizedSession(self.credentials)
-        log.debug("Authorized HTTP session created")
+        self.http_session = build_session(self.credentials, pool_size)
+        log.debug("Authorized HTTP session created (pool size: %d)", pool_size)
 
-        # https://cloud.google.com/chronicle/docs/reference/search-api#regional_endpoints
-        # https://cloud.google.com/chronicle/docs/reference/ingestion-api#regional_endpoints
-        # select region
+        if token_refresh_margin > 0:
+            TokenRefresherThread(self.credentials, token_refresh_margin).start()
 
-        # Map region codes to their endpoints
-        # Make region case-insensitive
-        region_upper = self.region.upper() if self.region else ""
-        log.debug("Using region (uppercase): %s", region_upper or "empty (will default to US)")
-
-        # Map of region codes to their endpoints
-        region_endpoints = {
-            # Legacy region codes
-            "EU": "https://europe-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
-            "UK": "https://europe-west2-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
-            "IL": "https://me-west1-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
-            "AU": "https://australia-southeast1-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
-            "SG": "https://asia-southeast1-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
-
-            # New region codes based on Google Cloud regions
-            "US": "https://malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
-            "EUROPE": "https://europe-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
-            "EUROPE-WEST2": "https://europe-west2-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
-            "EUROPE-WEST3": "https://europe-west3-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
-            "EUROPE-WEST6": "https://europe-west6-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
-            "EUROPE-WEST9": "https://europe-west9-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
-            "EUROPE-WEST12": "https://europe-west12-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
-            "ME-WEST1": "https://me-west1-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
-            "ME-CENTRAL1": "https://me-central1-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
-            "ME-CENTRAL2": "https://me-central2-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
-            "ASIA-SOUTH1": "https://asia-south1-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
-            "ASIA-SOUTHEAST1": "https://asia-southeast1-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
-            "ASIA-NORTHEAST1": "https://asia-northeast1-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
-            "AUSTRALIA-SOUTHEAST1": "https://australia-southeast1-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
-            "SOUTHAMERICA-EAST1": "https://southamerica-east1-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
-            "NORTHAMERICA-NORTHEAST2": "https://northamerica-northeast2-malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate",
-        }
-
-        # Default to US multi-region if region is not specified or not recognized
-        self.ingest_endpoint = region_endpoints.get(region_upper, "https://malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate")
-        log.debug("Using Chronicle ingest endpoint: %s", self.ingest_endpoint)
+        self.ingest_endpoint = endpoint or self.backend.endpoint
+        log.debug("Using Chronicle ingest endpoint: %s (%s API, up to %d indicators per request)",
+                  self.ingest_endpoint, self.backend.NAME, self.batch_size)
 
     def send_indicators(self, indicators):
-        """Send a batch of indicators to Chronicle."""
-        log.debug("Preparing to send %d indicators to Chronicle", len(indicators))
-
-        batch = [
-            {
-                "log_text": json.dumps(i),
-                "ts_epoch_microseconds": self._indicator_ts(i)
-            }
-            for i in indicators
-        ]
+        """Send indicators to Chronicle, in as many requests as needed."""
+        for payload in self.prepare_batches(indicators):
+            self.send_payload(payload)
 
+    def prepare_batches(self, indicators):
+        """Serialize indicators into request bodies within the backend's entry and size limits."""
+        log.debug("Preparing to send %d indicators to Chronicle", len(indicators))
+        payloads = []
+        batch = []
+        # Limits apply to the uncompressed body; the JSON escaping of log_text counts too
+        envelope_bytes = len(json.dumps(self.backend.body([])))
+        batch_bytes = envelope_bytes
+        for i in indicators:
+            entry = self._entry(i)
+            entry_bytes = len(json.dumps(entry)) + 2
+            if batch and (len(batch) >= self.batch_size or batch_bytes + entry_bytes > self.backend.MAX_BYTES):
+                payloads.append(self._encode(batch))
+                batch = []
+                batch_bytes = envelope_bytes
+            batch.append(entry)
+            batch_bytes += entry_bytes
+        if batch:
+            payloads.append(self._encode(batch))
         if indicators:
             log.debug("First indicator type: %s, ID: %s",
                       indicators[0].get('type', 'unknown'),
                       indicators[0].get('id', 'unknown'))
+        log.debug("Prepared %d indicators in %d requests", len(indicators), len(payloads))
+        return payloads
+
+    def _entry(self, indicator):
+        return self.backend.entry(json.dumps(indicator), self._indicator_ts(indicator))
+
+    def _encode(self, entries):
+        log.debug("Request body for the %s API contains %d entries", self.backend.NAME, len(entries))
+        return encode_body(self.backend.body(entries), self.compress)
 
-        self._send(batch)
+    def reset_session(self):
+        """Drop all pooled connections and start over with a fresh session."""
+        old_session = self.http_session
+        self.http_session = build_session(self.credentials, self.pool_size)
+        old_session.close()
+        log.debug("Authorized HTTP session recreated")
+
+    def _session(self):
+        """Return the HTTP session, recreating it first if its connections sat idle for too long.
+
+        Idle keep-alive connections get silently closed by load balancers; dropping them
+        up front avoids paying for a failed request and a retry.
+        """
+        now = time.monotonic()
+        idle = now - self._last_used
+        self._last_used = now
+        if self.max_idle and idle > self.max_idle:
+            log.debug("HTTP session idle for %d seconds, recreating", idle)
+            self.reset_session()
+        return self.http_session
 
     @staticmethod
     def _indicator_ts(indicator):
@@ -104,25 +290,23 @@ class Chronicle:
                 pass
         return int(datetime.datetime.utcnow().timestamp() * 1_000_000)
 
-    def _send(self, entries):
-        """Send a batch of log entries to Chronicle."""
-        log.debug("Sending %d entries to Chronicle", len(entries))
-
-        body = {
-            'customer_id': self.customer_id,
-            'log_type': "CROWDSTRIKE_IOC",
-            'entries': entries,
-        }
+    def _headers(self):
+        headers = {'Content-Type': 'application/json'}
+        if self.compress:
+            headers['Content-Encoding'] = 'gzip'
+        return headers
 
+    def send_payload(self, payload):
+        """Send a request body built by prepare_batches() to Chronicle."""
+        log.debug("Sending %d bytes to Chronicle", len(payload))
         log.debug("POST request to: %s", self.ingest_endpoint)
-        log.debug("Request body contains customer_id: %s, log_type: CROWDSTRIKE_IOC, entries count: %d",
-                  self.customer_id, len(entries))
 
         # Add explicit timeouts to prevent hanging connections
         try:
-            response = self.http_session.post(
+            response = self._session().post(
                 self.ingest_endpoint,
-                json=body,
+                data=payload,
+                headers=self._headers(),
                 timeout=(10, 30)  # (connect timeout, read timeout) in seconds
             )
             log.debug("Chronicle API response status code: %d", response.status_code)
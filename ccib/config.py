@@ -1,5 +1,6 @@
 import os
 import configparser
+from functools import cache
 
 
 class FigConfig(configparser.ConfigParser):
@@ -13,14 +14,30 @@ class FigConfig(configparser.ConfigParser):
         ['chronicle', 'service_account', 'GOOGLE_SERVICE_ACCOUNT_FILE'],
         ['chronicle', 'customer_id', 'CHRONICLE_CUSTOMER_ID'],
         ['chronicle', 'region', 'CHRONICLE_REGION'],
+        ['chronicle', 'ingestion_api', 'CHRONICLE_INGESTION_API'],
+        ['chronicle', 'project_id', 'CHRONICLE_PROJECT_ID'],
+        ['indicators', 'refresh_ttl', 'REFRESH_TTL'],
         ['icache', 'max_size', 'ICACHE_MAX_SIZE'],
         ['state', 'file', 'STATE_FILE'],
+        ['state', 'backend', 'STATE_BACKEND'],
+        ['state', 'database', 'STATE_DATABASE'],
+        ['budget', 'daily_bytes', 'INGESTION_DAILY_BYTES'],
+        ['sharding', 'shards', 'SHARDS'],
+        ['sharding', 'coordinator', 'SHARD_COORDINATOR'],
+        ['sharding', 'replica_id', 'REPLICA_ID'],
+        ['profiling', 'port', 'PROFILING_PORT'],
+        ['tracing', 'exporter', 'TRACING_EXPORTER'],
+        ['tracing', 'sample_rate', 'TRACING_SAMPLE_RATE'],
     ]
     OPTIONAL_CONFIGS = {('state', 'file')}
+    STATE_BACKENDS = {'json', 'sqlite'}
+    INGESTION_APIS = {'batchcreate', 'logs_import'}
+    TRACING_EXPORTERS = {'none', 'jsonl', 'otlp'}
+    CONFIG_FILES = ['config/defaults.ini', 'config/config.ini', 'config/devel.ini']
 
-    def __init__(self):
+    def __init__(self, files=None):
         super().__init__()
-        self.read(['config/defaults.ini', 'config/config.ini', 'config/devel.ini'])
+        self.read(files if files is not None else self.__class__.CONFIG_FILES)
         self._override_from_env()
 
     def _override_from_env(self):
@@ -42,11 +59,29 @@ class FigConfig(configparser.ConfigParser):
 
         self.validate_falcon()
         self.validate_chronicle()
+        self.validate_ingestion()
+        self.validate_sharding()
+        self.validate_indicators()
+        self.validate_budget()
+        self.validate_lanes()
+        self.validate_tracing()
 
+        if self.get('state', 'backend') not in self.STATE_BACKENDS:
+            raise Exception(f'Malformed configuration: expected state.backend to be in {self.STATE_BACKENDS}')
+        if int(self.get('profiling', 'port')) not in range(0, 65536):
+            raise Exception('Malformed configuration: expected profiling.port to be in range 0-65535')
+
+    def validate_indicators(self):
+        """Validate the indicators configuration."""
         if int(self.get('indicators', 'sync_frequency')) not in range(1, 3600):
             raise Exception('Malformed configuration: expected indicators.sync_frequency to be in range 1-3600')
         if int(self.get('indicators', 'initial_sync_lookback')) not in range(60, 7776000):
             raise Exception('Malformed configuration: expected indicators.initial_sync_lookback to be in range 60-7776000')
+        refresh_ttl = int(self.get('indicators', 'refresh_ttl'))
+        if refresh_ttl and refresh_ttl < int(self.get('indicators', 'sync_frequency')):
+            raise Exception('Malformed configuration: expected indicators.refresh_ttl to be 0 or at least indicators.sync_frequency')
+        if int(self.get('indicators', 'refresh_max_per_cycle')) < 1:
+            raise Exception('Malformed configuration: expected indicators.refresh_max_per_cycle to be positive')
 
     def validate_falcon(self):
         """Validate the Falcon configuration."""
@@ -63,6 +98,59 @@ class FigConfig(configparser.ConfigParser):
         """Validate the Chronicle configuration."""
         if len(self.get('chronicle', 'customer_id')) == 0:
             raise Exception('Malformed Configuration: expected chronicle.customer_id to be non-empty')
+        if int(self.get('chronicle', 'pool_size')) not in range(0, 101):
+            raise Exception('Malformed configuration: expected chronicle.pool_size to be in range 0-100')
+        if int(self.get('chronicle', 'token_refresh_margin')) not in range(0, 3000):
+            raise Exception('Malformed configuration: expected chronicle.token_refresh_margin to be in range 0-2999')
+        if int(self.get('chronicle', 'max_idle')) < 0:
+            raise Exception('Malformed configuration: expected chronicle.max_idle to be non-negative')
+
+    def validate_ingestion(self):
+        """Validate the Chronicle ingestion API configuration."""
+        api = self.get('chronicle', 'ingestion_api')
+        if api not in self.INGESTION_APIS:
+            raise Exception(f'Malformed configuration: expected chronicle.ingestion_api to be in {self.INGESTION_APIS}')
+        if api == 'logs_import' and len(self.get('chronicle', 'project_id')) == 0:
+            raise Exception('Malformed Configuration: expected chronicle.project_id to be non-empty for logs_import')
+        if int(self.get('chronicle', 'batch_size')) < 0:
+            raise Exception('Malformed configuration: expected chronicle.batch_size to be non-negative')
+        endpoint = self.get('chronicle', 'endpoint')
+        if endpoint and not endpoint.startswith(('http://', 'https://')):
+            raise Exception('Malformed configuration: expected chronicle.endpoint to be an http(s) URL')
+
+    def validate_lanes(self):
+        """Validate the lanes configuration."""
+        for var in ('fresh_weight', 'backfill_weight', 'refresh_weight'):
+            if int(self.get('lanes', var)) not in range(1, 101):
+                raise Exception(f'Malformed configuration: expected lanes.{var} to be in range 1-100')
+        if int(self.get('lanes', 'fresh_max_age')) < 0:
+            raise Exception('Malformed configuration: expected lanes.fresh_max_age to be non-negative')
+
+    def validate_budget(self):
+        """Validate the ingestion budget configuration."""
+        for var in ('requests_per_second', 'bytes_per_second'):
+            if float(self.get('budget', var)) < 0:
+                raise Exception(f'Malformed configuration: expected budget.{var} to be non-negative')
+        # Parsed like IngestionBudget.from_config does, so that e.g. 1e9 is accepted by both
+        if int(float(self.get('budget', 'daily_bytes'))) < 0:
+            raise Exception('Malformed configuration: expected budget.daily_bytes to be non-negative')
+
+    def validate_tracing(self):
+        """Validate the tracing configuration."""
+        if self.get('tracing', 'exporter') not in self.TRACING_EXPORTERS:
+            raise Exception(f'Malformed configuration: expected tracing.exporter to be in {self.TRACING_EXPORTERS}')
+        if not 0 <= float(self.get('tracing', 'sample_rate')) <= 1:
+            raise Exception('Malformed configuration: expected tracing.sample_rate to be in range 0-1')
+
+    def validate_sharding(self):
+        """Validate the sharding configuration."""
+        if int(self.get('sharding', 'shards')) not in range(0, 1025):
+            raise Exception('Malformed configuration: expected sharding.shards to be in range 0-1024')
+        if int(self.get('sharding', 'lease_ttl')) not in range(10, 3601):
+            raise Exception('Malformed configuration: expected sharding.lease_ttl to be in range 10-3600')
 
 
-config = FigConfig()
+@cache
+def get_config():
+    """Return the process-wide configuration, reading it on first use."""
+    return FigConfig()
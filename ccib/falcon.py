@@ -1,8 +1,8 @@
 from functools import reduce
+import logging
 import time
 import json
-from falconpy import Intel
-from .config import config
+from .config import get_config
 from .log import log
 from .helper import thousands
 from .version import __version__
@@ -18,6 +18,9 @@ class FalconAPI():
     }
 
     def __init__(self):
+        from falconpy import Intel  # falconpy is slow to import, load it only when needed
+
+        config = get_config()
         base_url = self.__class__.base_url()
         log.debug("Initializing Falcon Intel API client with base URL: %s", base_url)
         self.intel = Intel(client_id=config.get('falcon', 'client_id'),
@@ -30,7 +33,7 @@ class FalconAPI():
     @classmethod
     def base_url(cls):
         """Return the base URL for the CrowdStrike Falcon API."""
-        return 'https://' + cls.CLOUD_REGIONS[config.get('falcon', 'cloud_region')]
+        return 'https://' + cls.CLOUD_REGIONS[get_config().get('falcon', 'cloud_region')]
 
     @property
     def request_size_limit(self):
@@ -72,6 +75,25 @@ class FalconAPI():
                 log.debug("Retrying in 5 seconds...")
                 time.sleep(5)
 
+    def get_indicators_by_ids(self, ids):
+        """Get the current version of indicators by their ids.
+
+        Ids unknown to Falcon are left out of the result. Unlike get_indicators, errors
+        are raised rather than retried.
+        """
+        indicators = []
+        for i in range(0, len(ids), self.request_size_limit):
+            chunk = ids[i:i + self.request_size_limit]
+            log.debug("Fetching %d indicators by id from Falcon API", len(chunk))
+            resp_json = self.intel.get_indicator_entities(ids=chunk)
+            status_code = resp_json.get('status_code', 200)
+            body = resp_json['body']
+            # 404 is returned along with the indicators found when some of the ids are unknown
+            if status_code not in (200, 404):
+                raise Exception(f'Unexpected response status from CrowdStrike Falcon: {status_code} Errors: {body.get("errors", [])}')
+            indicators.extend(body.get('resources') or [])
+        return indicators
+
     def get_indicators(self, start_time):
         """Get all the indicators starting from a given marker or UNIX timestamp.
 
@@ -109,8 +131,9 @@ class FalconAPI():
             log.debug("Batch contains %d indicators, total fetched so far: %d",
                       batch_size, total_indicators_fetched)
 
-            # Only log sample indicators if there's a reasonable number
-            if 0 < batch_size <= 10:
+            # Only log sample indicators if there's a reasonable number, and skip
+            # building the id list altogether unless debug logging is on
+            if 0 < batch_size <= 10 and log.isEnabledFor(logging.DEBUG):
                 log.debug("Indicators in batch: %s",
                           ", ".join([i.get('id', 'unknown') for i in indicators_in_request]))
             elif batch_size > 10:
@@ -1,20 +1,51 @@
 import hashlib
 import json
+import threading
+import time
 from collections import OrderedDict
 
 from .log import log
+from .store import get_store
 
 
-class ICache:
-    """Cache for indicators."""
-    def __init__(self, max_size=None):
+class ICache:  # pylint: disable=R0902
+    """Cache for indicators.
+
+    With a store, the in-memory cache only holds the most recently seen digests and
+    the store holds all of them. Digests of new or changed indicators are kept aside
+    until save() is called with them, which the writer does once they were sent.
+    save() also records when each indicator was last sent, see stale().
+    """
+    def __init__(self, max_size=None, store=None):
         self.cache = OrderedDict()
         self.max_size = max_size
         self.evictions = 0
-        log.debug("Initialized indicator cache (max_size=%s)", max_size)
+        self.store = store
+        self.sent_at = OrderedDict()
+        # The reader looks up indicators while the writer records sent ones
+        self._lock = threading.Lock()
+        self._prefetched = {}
+        self._unsaved = {}
+        log.debug("Initialized indicator cache (max_size=%s, store=%s)", max_size,
+                  store.path if store is not None else None)
 
-    def exists(self, indicator):
-        """Check if an indicator exists in the cache."""
+    @classmethod
+    def from_config(cls, config):
+        """Create a cache sized according to icache.max_size (0 means unlimited)."""
+        max_size = int(config.get('icache', 'max_size'))
+        return cls(max_size=max_size if max_size > 0 else None, store=get_store(config))
+
+    def prefetch(self, ids):
+        """Look up the digests of a batch of indicators in the store with a single query."""
+        if self.store is None:
+            return
+        missing = [iid for iid in ids if iid not in self.cache]
+        found = self.store.get_digests(missing)
+        self._prefetched = {iid: found.get(iid) for iid in missing}
+
+    @staticmethod
+    def digest(indicator):
+        """Return the id of an indicator and the hash of its content, ignoring timestamps."""
         cpy = indicator.copy()
         cpy.pop('last_updated')
 
@@ -28,33 +59,106 @@ class ICache:
         content_hash = hashlib.sha256(
             json.dumps(cpy, sort_keys=True, default=str).encode()
         ).hexdigest()
+        return iid, content_hash
 
-        if iid in self.cache:
-            if self.cache[iid] == content_hash:
+    def exists(self, indicator):
+        """Check if an indicator exists in the cache."""
+        iid, content_hash = self.digest(indicator)
+
+        with self._lock:
+            if iid not in self.cache and self.store is not None:
+                self._load(iid)
+
+            if iid in self.cache:
+                if self.cache[iid] == content_hash:
+                    self.cache.move_to_end(iid)
+                    return True
+                # Content changed — update hash
+                self.cache[iid] = content_hash
                 self.cache.move_to_end(iid)
-                return True
-            # Content changed — update hash
+                self._remember(iid, content_hash)
+                return False
+
             self.cache[iid] = content_hash
-            self.cache.move_to_end(iid)
+            self._evict_if_needed()
+            self._remember(iid, content_hash)
             return False
 
-        self.cache[iid] = content_hash
-        self._evict_if_needed()
-        return False
+    def _load(self, iid):
+        """Bring a digest from the store into the in-memory cache."""
+        if iid in self._prefetched:
+            digest = self._prefetched.pop(iid)
+        else:
+            digest = self.store.get_digests([iid]).get(iid)
+        if digest is not None:
+            self.cache[iid] = digest
+            self._evict_if_needed()
+
+    def _remember(self, iid, content_hash):
+        self._unsaved[iid] = content_hash
+
+    def take_unsaved(self):
+        """Return and forget the digests not yet handed over for saving."""
+        unsaved, self._unsaved = self._unsaved, {}
+        return unsaved
+
+    def save(self, digests):
+        """Record digests of indicators that were sent, persisting them in a single transaction."""
+        if not digests:
+            return
+        now = time.time()
+        with self._lock:
+            for iid, content_hash in digests.items():
+                if iid in self.cache:
+                    self.cache[iid] = content_hash
+                    self.sent_at[iid] = now
+                    self.sent_at.move_to_end(iid)
+        if self.store is not None:
+            self.store.put_digests(digests, sent_at=now)
+
+    def stale(self, older_than, limit, keep=None):
+        """Return up to limit ids of indicators last sent before older_than, oldest first.
+
+        With keep, only ids for which keep(id) is true are returned.
+        """
+        if self.store is not None:
+            return self.store.get_stale(older_than, limit, keep)
+        ids = []
+        with self._lock:
+            for iid, sent_at in self.sent_at.items():
+                if sent_at >= older_than or len(ids) >= limit:
+                    break
+                if keep is None or keep(iid):
+                    ids.append(iid)
+        return ids
+
+    def tracked(self):
+        """Return the number of indicators whose last send time is known."""
+        if self.store is not None:
+            return self.store.count_digests()
+        return len(self.sent_at)
+
+    def forget(self, ids):
+        """Drop indicators from the cache and the store."""
+        with self._lock:
+            for iid in ids:
+                self.cache.pop(iid, None)
+                self.sent_at.pop(iid, None)
+        if self.store is not None:
+            self.store.delete_digests(ids)
 
     def _evict_if_needed(self):
         """Evict oldest entries if cache exceeds max_size."""
         if self.max_size is None:
             return
         while len(self.cache) > self.max_size:
-            self.cache.popitem(last=False)
+            iid, _ = self.cache.popitem(last=False)
+            self.sent_at.pop(iid, None)
             self.evictions += 1
 
     def get_stats(self):
         """Return cache statistics."""
-        return {'size': len(self.cache), 'max_size': self.max_size, 'evictions': self.evictions}
-
-
-from .config import config  # noqa: E402  pylint: disable=C0413
-_max_size_val = int(config.get('icache', 'max_size'))
-icache = ICache(max_size=_max_size_val if _max_size_val > 0 else None)
+        stats = {'size': len(self.cache), 'max_size': self.max_size, 'evictions': self.evictions}
+        if self.store is not None:
+            stats['stored'] = self.store.count_digests()
+        return stats
@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import deque
+
+
+FRESH = 'fresh'
+BACKFILL = 'backfill'
+REFRESH = 'refresh'
+LANES = (FRESH, BACKFILL, REFRESH)
+
+
+class LanePolicy:
+    """Decides which lane an indicator goes to.
+
+    Indicators with one of the configured confidences or types, or published
+    recently, go to the fresh lane; everything else read from Falcon is backfill.
+    """
+    def __init__(self, confidences=('high',), max_age=86400, types=()):
+        self.confidences = set(confidences)
+        self.max_age = max_age
+        self.types = set(types)
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a policy from the [lanes] configuration section."""
+        def _list(var):
+            return [v.strip() for v in config.get('lanes', var).split(',') if v.strip()]
+        return cls(confidences=_list('fresh_confidence'),
+                   max_age=int(config.get('lanes', 'fresh_max_age')),
+                   types=_list('fresh_types'))
+
+    def lane_of(self, indicator, now=None):
+        """Return the lane for an indicator read from Falcon."""
+        if indicator.get('malicious_confidence') in self.confidences or indicator.get('type') in self.types:
+            return FRESH
+        if self.max_age:
+            try:
+                published = float(indicator.get('published_date') or 0)
+            except (ValueError, TypeError):
+                published = 0
+            if published >= (now if now is not None else time.time()) - self.max_age:
+                return FRESH
+        return BACKFILL
+
+
+class LaneQueue:
+    """Bounded queue with one FIFO lane per priority, served by smooth weighted round robin.
+
+    The reader puts each page split into lanes with put_page(); the writer calls
+    done() for every part it took from get(). Parts of a page may be sent out of
+    order, but done() only hands back a marker once the page and all the pages
+    before it are done, so the saved marker never skips unsent indicators.
+    """
+    def __init__(self, weights, maxsize=10):
+        self.weights = dict(weights)
+        self.maxsize = maxsize
+        self._lanes = {lane: deque() for lane in self.weights}
+        self._current = {lane: 0 for lane in self.weights}
+        self._cond = threading.Condition()
+        self._next_seq = 0
+        # seq -> [parts not done yet, marker, shards], in page order
+        self._pages = {}
+
+    @classmethod
+    def from_config(cls, config, maxsize=10):
+        """Create a queue with the lane weights from the [lanes] configuration section."""
+        return cls({lane: int(config.get('lanes', f'{lane}_weight')) for lane in LANES}, maxsize=maxsize)
+
+    def qsize(self, lane=None):
+        """Return the number of parts waiting in a lane, or in all lanes."""
+        with self._cond:
+            if lane is not None:
+                return len(self._lanes[lane])
+            return sum(len(items) for items in self._lanes.values())
+
+    def put(self, lane, indicators, digests, seq=None, trace=None):
+        """Put a part in a lane, blocking while the lane is full."""
+        with self._cond:
+            while len(self._lanes[lane]) >= self.maxsize:
+                self._cond.wait()
+            self._lanes[lane].append((indicators, digests, seq, trace))
+            self._cond.notify_all()
+
+    def put_page(self, parts, marker, shards=None, trace=None):
+        """Put the parts of a page, a dict of lane to (indicators, digests), in their lanes."""
+        with self._cond:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._pages[seq] = [len(parts), marker, shards]
+        for lane, (indicators, digests) in parts.items():
+            self.put(lane, indicators, digests, seq, trace)
+
+    def get(self):
+        """Take the next part, as (indicators, digests, seq, trace), blocking while all lanes are empty."""
+        with self._cond:
+            while True:
+                ready = [lane for lane, items in self._lanes.items() if items]
+                if ready:
+                    break
+                self._cond.wait()
+            # Smooth weighted round robin: lanes get turns in proportion to their weight, evenly interleaved
+            total = 0
+            for lane in ready:
+                self._current[lane] += self.weights[lane]
+                total += self.weights[lane]
+            lane = max(ready, key=lambda name: self._current[name])
+            self._current[lane] -= total
+            item = self._lanes[lane].popleft()
+            self._cond.notify_all()
+            return item
+
+    def done(self, seq):
+        """Mark a part as done; return (marker, shards) of the last page done in order, if any."""
+        if seq is None:
+            return None
+        committed = None
+        with self._cond:
+            self._pages[seq][0] -= 1
+            while self._pages:
+                first = next(iter(self._pages))
+                remaining, marker, shards = self._pages[first]
+                if remaining:
+                    break
+                del self._pages[first]
+                committed = (marker, shards)
+        return committed
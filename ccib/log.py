@@ -1,14 +1,21 @@
 import logging
-from .config import config
-
-level = logging.getLevelName(config.get('logging', 'level'))
 
 log = logging.getLogger('ccib')
-log.setLevel(level)
 
-ch = logging.StreamHandler()
-ch.setLevel(level)
 
-formatter = logging.Formatter('%(asctime)s %(name)s %(threadName)-10s %(levelname)-8s %(message)s', '%Y-%m-%d %H:%M:%S')
-ch.setFormatter(formatter)
-log.addHandler(ch)
+def setup_logging(level_name):
+    """Set the log level and attach the console handler (once)."""
+    level = logging.getLevelName(level_name)
+    log.setLevel(level)
+
+    if log.handlers:
+        for handler in log.handlers:
+            handler.setLevel(level)
+        return
+
+    ch = logging.StreamHandler()
+    ch.setLevel(level)
+
+    formatter = logging.Formatter('%(asctime)s %(name)s %(threadName)-10s %(levelname)-8s %(message)s', '%Y-%m-%d %H:%M:%S')
+    ch.setFormatter(formatter)
+    log.addHandler(ch)
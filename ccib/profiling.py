@@ -0,0 +1,209 @@
+import cProfile
+import io
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from .log import log
+
+
+class Profiler:
+    """On-demand, time-boxed cProfile of the worker threads.
+
+    Up to Python 3.11, cProfile only sees the thread that enabled it, so the worker
+    threads wrap each unit of work in section(). While a session is active, every
+    section runs under its own profile; when the session ends the profiles are
+    merged per thread and dumped to the output directory. From Python 3.12 on,
+    cProfile is built on sys.monitoring and sees all threads at once, so a single
+    profile covers the whole session and is dumped as 'all-threads'.
+    """
+    MAX_DURATION = 3600
+    PER_THREAD = sys.version_info < (3, 12)
+
+    def __init__(self, output_dir='data/profiles', duration=60, top=25):
+        self.output_dir = output_dir
+        self.duration = duration
+        self.top = top
+        self._lock = threading.Lock()
+        self._session = None
+        self._profiles = []
+        self._session_profile = None
+
+    @property
+    def active(self):
+        """True while a profiling session is running."""
+        return self._session is not None
+
+    def start(self, duration=None):
+        """Start a profiling session, return False if one is already running."""
+        duration = min(duration or self.duration, self.MAX_DURATION)
+        with self._lock:
+            if self._session is not None:
+                log.warning("Profiling session already running, ignoring request")
+                return False
+            if not self.PER_THREAD:
+                profile = cProfile.Profile()
+                try:
+                    profile.enable()
+                except ValueError:
+                    log.warning("Another profiling tool is active, ignoring request")
+                    return False
+                self._session_profile = profile
+            self._session = session = time.strftime('%Y%m%d-%H%M%S')
+            self._profiles = []
+        log.info("Profiling worker threads for %d seconds", duration)
+        timer = threading.Timer(duration, self._finish, args=(session,))
+        timer.daemon = True
+        timer.start()
+        return True
+
+    @contextmanager
+    def section(self):
+        """Profile the enclosed block if a profiling session is active."""
+        session = self._session
+        if session is None or not self.PER_THREAD:
+            yield
+            return
+
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self._lock:
+                if self._session == session:
+                    self._profiles.append((threading.current_thread().name, profile))
+
+    def stop(self):
+        """End the running profiling session now and write its profiles."""
+        self._finish(self._session)
+
+    def _finish(self, session):
+        with self._lock:
+            if session is None or self._session != session:
+                return
+            profiles = self._profiles
+            self._session, self._profiles = None, []
+            if self._session_profile is not None:
+                self._session_profile.disable()
+                profiles = [('all-threads', self._session_profile)]
+                self._session_profile = None
+
+        if not profiles:
+            log.info("Profiling session finished, no work was done by the worker threads")
+            return
+
+        by_thread = {}
+        for name, profile in profiles:
+            by_thread.setdefault(name, []).append(profile)
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        for name, thread_profiles in by_thread.items():
+            path = os.path.join(self.output_dir, f'profile-{session}-{name}')
+            stats = pstats.Stats(*thread_profiles)
+            stats.dump_stats(path + '.prof')
+
+            summary = io.StringIO()
+            pstats.Stats(path + '.prof', stream=summary).sort_stats('cumulative').print_stats(self.top)
+            # Write the summary in one go so readers never see a partial file
+            with open(path + '.txt.tmp', 'w', encoding='utf-8') as fh:
+                fh.write(summary.getvalue())
+            os.replace(path + '.txt.tmp', path + '.txt')
+            log.info("Profile of %s written to %s.prof (%d sections)", name, path, len(thread_profiles))
+
+
+def heap_snapshot(output_dir='data/profiles', top=25):
+    """Write the top memory allocation sites to the output directory and return the file path.
+
+    If tracemalloc was not started at start-up, the first call only starts tracing
+    and returns None; snapshots taken from then on cover allocations made since.
+    """
+    if not tracemalloc.is_tracing():
+        log.warning("tracemalloc was not started at start-up (profiling.tracemalloc); tracing allocations from now "
+                    "on, request another heap snapshot later")
+        tracemalloc.start()
+        return None
+
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"heap-{time.strftime('%Y%m%d-%H%M%S')}.txt")
+    with open(path, 'w', encoding='utf-8') as fh:
+        fh.write(f"Traced memory: current {current / 1024 / 1024:.1f} MiB, peak {peak / 1024 / 1024:.1f} MiB\n")
+        fh.write(f"Top {top} allocation sites:\n")
+        for stat in snapshot.statistics('lineno')[:top]:
+            fh.write(f"{stat}\n")
+    log.info("Heap snapshot written to %s", path)
+    return path
+
+
+def install_signal_handlers(profiler):
+    """Start a profiling session on SIGUSR1 and take a heap snapshot on SIGUSR2.
+
+    Does nothing on platforms without these signals.
+    """
+    if not hasattr(signal, 'SIGUSR1'):
+        log.debug("Profiling signals are not supported on this platform")
+        return
+
+    def on_sigusr1(_signum, _frame):
+        profiler.start()
+
+    def on_sigusr2(_signum, _frame):
+        threading.Thread(target=heap_snapshot, args=(profiler.output_dir, profiler.top),
+                         name='HeapSnapshot', daemon=True).start()
+
+    signal.signal(signal.SIGUSR1, on_sigusr1)
+    signal.signal(signal.SIGUSR2, on_sigusr2)
+    log.debug("Profiling signal handlers installed (SIGUSR1: cProfile, SIGUSR2: heap snapshot)")
+
+
+class _ProfilingRequestHandler(BaseHTTPRequestHandler):
+    profiler = None
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == '/profile':
+            seconds = parse_qs(url.query).get('seconds', [None])[0]
+            if seconds is not None and not seconds.isdigit():
+                self._reply(400, 'seconds must be a positive integer\n')
+            elif self.profiler.start(int(seconds) if seconds else None):
+                self._reply(202, f'profiling started, output in {self.profiler.output_dir}\n')
+            else:
+                self._reply(409, 'profiling session already running\n')
+        elif url.path == '/heap':
+            path = heap_snapshot(self.profiler.output_dir, self.profiler.top)
+            if path is None:
+                self._reply(202, 'tracemalloc started, request another snapshot later\n')
+            else:
+                self._reply(200, f'{path}\n')
+        else:
+            self._reply(404, 'not found\n')
+
+    def _reply(self, status, text):
+        body = text.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        log.debug("Profiling endpoint: " + format, *args)
+
+
+def start_http_endpoint(profiler, port):
+    """Serve POST /profile?seconds=N and POST /heap on localhost in a background thread."""
+    handler = type('ProfilingRequestHandler', (_ProfilingRequestHandler,), {'profiler': profiler})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, name='ProfilingHTTP', daemon=True).start()
+    log.info("Profiling endpoint listening on 127.0.0.1:%d", server.server_address[1])
+    return server
@@ -0,0 +1,158 @@
+import hashlib
+import math
+import os
+import signal
+import socket
+import sqlite3
+import threading
+import time
+from .log import log
+
+
+def shard_of(indicator_id, shards):
+    """Return the hash shard of an indicator id, stable across processes and hosts."""
+    return int(hashlib.sha256(indicator_id.encode()).hexdigest()[:8], 16) % shards
+
+
+class ShardCoordinator:
+    """Hands out leases on hash shards of the indicator stream to bridge replicas.
+
+    Coordination goes through an SQLite database that all replicas can reach, either
+    on a shared volume or on a local path when the replicas run on the same host.
+    The database uses the default rollback journal rather than WAL, since WAL does
+    not work across hosts. Each replica heartbeats, keeps its fair share of the
+    shards and picks up shards whose lease expired when another replica died.
+    Markers are kept per shard so a new owner resumes where the old one stopped.
+    """
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS replicas (replica TEXT PRIMARY KEY, heartbeat REAL NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS leases (shard INTEGER PRIMARY KEY, replica TEXT NOT NULL, expires REAL NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS markers (shard INTEGER PRIMARY KEY, marker TEXT NOT NULL)',
+    ]
+
+    def __init__(self, path, shards, replica_id=None, lease_ttl=120):
+        self.path = path
+        self.shards = shards
+        self.replica_id = replica_id or f'{socket.gethostname()}-{os.getpid()}'
+        self.lease_ttl = lease_ttl
+        self.owned = frozenset()
+        self._local = threading.local()
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        with self._conn() as conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+        log.debug("Shard coordinator at %s, %d shards, replica id: %s", path, shards, self.replica_id)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None lets claim() issue BEGIN IMMEDIATE itself
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    def claim(self):
+        """Heartbeat, renew own leases and rebalance; return the set of shards now owned."""
+        now = time.time()
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('INSERT INTO replicas (replica, heartbeat) VALUES (?, ?) '
+                         'ON CONFLICT(replica) DO UPDATE SET heartbeat = excluded.heartbeat', (self.replica_id, now))
+            conn.execute('DELETE FROM replicas WHERE heartbeat < ?', (now - self.lease_ttl,))
+            conn.execute('DELETE FROM leases WHERE expires < ?', (now,))
+            replicas = conn.execute('SELECT COUNT(*) FROM replicas').fetchone()[0]
+            fair_share = math.ceil(self.shards / replicas)
+
+            owned = [row[0] for row in conn.execute(
+                'SELECT shard FROM leases WHERE replica = ? ORDER BY shard', (self.replica_id,))]
+            # Hand surplus shards back so that replicas which joined later get their share
+            for shard in owned[fair_share:]:
+                conn.execute('DELETE FROM leases WHERE shard = ?', (shard,))
+            owned = owned[:fair_share]
+
+            taken = {row[0] for row in conn.execute('SELECT shard FROM leases')}
+            free = [shard for shard in range(self.shards) if shard not in taken]
+            owned += free[:fair_share - len(owned)]
+
+            conn.executemany('INSERT INTO leases (shard, replica, expires) VALUES (?, ?, ?) '
+                             'ON CONFLICT(shard) DO UPDATE SET replica = excluded.replica, expires = excluded.expires',
+                             [(shard, self.replica_id, now + self.lease_ttl) for shard in owned])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+        owned = frozenset(owned)
+        if owned != self.owned:
+            log.info("Now owning %d of %d shards (%d live replicas): %s",
+                     len(owned), self.shards, replicas, sorted(owned))
+        self.owned = owned
+        return owned
+
+    def release(self):
+        """Give up all leases so other replicas take the shards over right away."""
+        with self._conn() as conn:
+            conn.execute('DELETE FROM leases WHERE replica = ?', (self.replica_id,))
+            conn.execute('DELETE FROM replicas WHERE replica = ?', (self.replica_id,))
+        self.owned = frozenset()
+
+    def load_markers(self, shards):
+        """Return a dict of shard to saved marker for the given shards."""
+        shards = list(shards)
+        placeholders = ','.join('?' * len(shards))
+        rows = self._conn().execute(
+            f'SELECT shard, marker FROM markers WHERE shard IN ({placeholders})', shards)  # nosec B608
+        return dict(rows)
+
+    def save_markers(self, shards, marker):
+        """Save the marker for those of the given shards this replica still holds a lease on."""
+        with self._conn() as conn:
+            conn.executemany(
+                'INSERT INTO markers (shard, marker) '
+                'SELECT ?, ? WHERE EXISTS (SELECT 1 FROM leases WHERE shard = ? AND replica = ? AND expires >= ?) '
+                'ON CONFLICT(shard) DO UPDATE SET marker = excluded.marker',
+                [(shard, marker, shard, self.replica_id, time.time()) for shard in shards])
+
+
+class ShardLeaseThread(threading.Thread):
+    """Thread that keeps this replica's shard leases alive."""
+    def __init__(self, coordinator, *args, **kwargs):
+        super().__init__(*args, daemon=True, **kwargs)
+        self.coordinator = coordinator
+        self.interval = max(coordinator.lease_ttl / 3, 1)
+
+    def run(self):
+        log.debug("Starting ShardLeaseThread (renewing every %d seconds)", self.interval)
+        renewed_at = time.time()
+        while True:
+            try:
+                self.coordinator.claim()
+                renewed_at = time.time()
+            except Exception:  # pylint: disable=W0703
+                log.exception("Could not renew shard leases")
+                if self.coordinator.owned and time.time() - renewed_at > self.coordinator.lease_ttl:
+                    log.warning("Shard leases expired, pausing until they can be renewed")
+                    self.coordinator.owned = frozenset()
+            time.sleep(self.interval)
+
+
+def install_release_handler(coordinator):
+    """Release the shard leases and exit on SIGTERM or SIGINT.
+
+    Without this, a replica that is stopped cleanly keeps its shards until the
+    leases expire, so failover would take up to lease_ttl.
+    """
+    def on_signal(signum, _frame):
+        log.info("Received signal %d, releasing shard leases before exit", signum)
+        try:
+            coordinator.release()
+        except Exception:  # pylint: disable=W0703
+            log.exception("Could not release shard leases")
+        # The worker threads never return, so leave without waiting for them
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
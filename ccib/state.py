@@ -1,15 +1,41 @@
 import json
 import os
 import tempfile
-from .config import config
+from .config import get_config
 from .log import log
+from .store import get_store
 
 
 def _state_file_path():
-    return config.get('state', 'file')
+    return get_config().get('state', 'file')
 
 
 def load_state():
+    """Load persisted state from the SQLite store or the state file.
+
+    When the SQLite store holds no state yet, the state file is read instead so
+    that switching backends resumes from the last saved marker.
+    """
+    store = get_store(get_config())
+    if store is not None:
+        state = store.load_state()
+        if state is not None:
+            log.info("Loaded state from %s: %s", store.path, state)
+            return state
+    return _load_state_file()
+
+
+def save_state(state):
+    """Persist state to the SQLite store or the state file."""
+    store = get_store(get_config())
+    if store is not None:
+        store.save_state(state)
+        log.debug("State saved to %s", store.path)
+        return
+    _save_state_file(state)
+
+
+def _load_state_file():
     """Load persisted state from the state file.
 
     Returns the state dict if successful, or None if the file is
@@ -30,7 +56,7 @@ def load_state():
         return None
 
 
-def save_state(state):
+def _save_state_file(state):
     """Atomically persist state to the state file.
 
     Writes to a temporary file in the same directory, then renames
@@ -0,0 +1,124 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from functools import cache
+from .log import log
+
+
+class SQLiteStore:
+    """SQLite (WAL mode) store for bridge state and indicator digests.
+
+    Every thread gets its own connection, so the reader can look up digests while
+    the writer commits them.
+    """
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS digests (id TEXT PRIMARY KEY, digest TEXT NOT NULL, sent_at REAL NOT NULL) WITHOUT ROWID',
+        'CREATE INDEX IF NOT EXISTS digests_sent_at ON digests (sent_at)',
+    ]
+    # SQLite limits the number of host parameters per statement
+    LOOKUP_CHUNK = 500
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+        conn = self._conn()
+        mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+        with conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+        log.debug("Opened SQLite store at %s (journal mode: %s)", path, mode)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            # WAL with synchronous=NORMAL stays consistent after a crash and only fsyncs on checkpoints
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def load_state(self):
+        """Return the saved state dict, or None if nothing was saved yet."""
+        rows = self._conn().execute('SELECT key, value FROM state').fetchall()
+        if not rows:
+            return None
+        return {key: json.loads(value) for key, value in rows}
+
+    def save_state(self, state):
+        """Replace the saved state with the given dict."""
+        with self._conn() as conn:
+            conn.execute('DELETE FROM state')
+            conn.executemany('INSERT INTO state (key, value) VALUES (?, ?)',
+                             [(key, json.dumps(value)) for key, value in state.items()])
+
+    def get_digests(self, ids):
+        """Return a dict of indicator id to digest for the ids present in the store."""
+        ids = list(ids)
+        conn = self._conn()
+        found = {}
+        for i in range(0, len(ids), self.LOOKUP_CHUNK):
+            chunk = ids[i:i + self.LOOKUP_CHUNK]
+            placeholders = ','.join('?' * len(chunk))
+            found.update(conn.execute(
+                f'SELECT id, digest FROM digests WHERE id IN ({placeholders})', chunk))  # nosec B608
+        return found
+
+    def put_digests(self, digests, sent_at=None):
+        """Insert or update indicator digests in a single transaction."""
+        if not digests:
+            return
+        sent_at = sent_at if sent_at is not None else time.time()
+        with self._conn() as conn:
+            conn.executemany(
+                'INSERT INTO digests (id, digest, sent_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(id) DO UPDATE SET digest = excluded.digest, sent_at = excluded.sent_at',
+                [(iid, digest, sent_at) for iid, digest in digests.items()])
+        log.debug("Stored %d indicator digests", len(digests))
+
+    def get_stale(self, older_than, limit, keep=None):
+        """Return up to limit ids of indicators last sent before older_than, oldest first.
+
+        With keep, only ids for which keep(id) is true count towards the limit.
+        """
+        if keep is None:
+            rows = self._conn().execute(
+                'SELECT id FROM digests WHERE sent_at < ? ORDER BY sent_at LIMIT ?', (older_than, limit))
+            return [row[0] for row in rows]
+        ids = []
+        if limit <= 0:
+            return ids
+        # The cursor reads rows lazily, so this stops as soon as enough ids were kept
+        for (iid,) in self._conn().execute('SELECT id FROM digests WHERE sent_at < ? ORDER BY sent_at', (older_than,)):
+            if keep(iid):
+                ids.append(iid)
+                if len(ids) >= limit:
+                    break
+        return ids
+
+    def delete_digests(self, ids):
+        """Delete the digests of the given indicators."""
+        with self._conn() as conn:
+            conn.executemany('DELETE FROM digests WHERE id = ?', [(iid,) for iid in ids])
+
+    def count_digests(self):
+        """Return the number of stored indicator digests."""
+        return self._conn().execute('SELECT COUNT(*) FROM digests').fetchone()[0]
+
+
+@cache
+def open_store(path):
+    """Return the store for the given database path, shared within the process."""
+    return SQLiteStore(path)
+
+
+def get_store(config):
+    """Return the configured SQLite store, or None when state.backend is json."""
+    if config.get('state', 'backend') != 'sqlite':
+        return None
+    return open_store(config.get('state', 'database'))
@@ -1,15 +1,18 @@
+import os
 import threading
 import time
-from google.auth.transport import requests
-from .icache import icache
-from .config import config
+from .config import get_config
+from .lanes import FRESH, REFRESH, LanePolicy
 from .log import log
+from .profiling import Profiler
+from .shards import shard_of
 from .state import save_state
+from .tracing import NOOP_TRACE, Tracer
 
 
 def transform(indicator):
     """Transform an indicator dictionary for comparison."""
-    indicator.pop('_marker')
+    indicator.pop('_marker', None)
     for label in indicator.get('labels', []):
         label.pop('last_valid_on')
     for rel in indicator.get('relations', []):
@@ -24,18 +27,47 @@ def _try_save_state(marker):
         log.exception("Failed to save state file")
 
 
-class FalconReaderThread(threading.Thread):
-    """Thread that reads indicators from Falcon."""
-    def __init__(self, falcon, queue, *args, resume_marker=None, **kwargs):
+def _try_save_shard_markers(coordinator, shards, marker):
+    try:
+        coordinator.save_markers(shards, marker)
+    except Exception:  # pylint: disable=W0718
+        log.exception("Failed to save shard markers")
+
+
+def _try_save_digests(icache, digests):
+    try:
+        icache.save(digests)
+    except Exception:  # pylint: disable=W0718
+        log.exception("Failed to save indicator digests")
+
+
+class FalconReaderThread(threading.Thread):  # pylint: disable=R0902
+    """Thread that reads indicators from Falcon.
+
+    With a shard coordinator, only indicators of the shards this replica holds a
+    lease on are processed, each shard resuming from its own marker.
+    """
+    def __init__(self, falcon, queue, icache, *args, resume_marker=None, profiler=None,  # pylint: disable=R0913
+                 coordinator=None, budget=None, tracer=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.falcon = falcon
         self.queue = queue
-        self.frequency = int(config.get('indicators', 'sync_frequency'))
+        self.icache = icache
+        self.profiler = profiler if profiler is not None else Profiler()
+        self.tracer = tracer if tracer is not None else Tracer()
+        self.frequency = int(get_config().get('indicators', 'sync_frequency'))
         self.resume_marker = resume_marker
+        self.coordinator = coordinator
+        self.budget = budget
+        self.owned = frozenset()
+        self.shard_markers = {}
+        self.refresh_ttl = int(get_config().get('indicators', 'refresh_ttl'))
+        self.refresh_max_per_cycle = int(get_config().get('indicators', 'refresh_max_per_cycle'))
+        self.lane_policy = LanePolicy.from_config(get_config())
 
     def run(self):
         """Read indicators from Falcon and put them in the queue."""
-        initial_lookback = int(config.get('indicators', 'initial_sync_lookback'))
+        initial_lookback = int(get_config().get('indicators', 'initial_sync_lookback'))
 
         if self.resume_marker is not None:
             ts = self.resume_marker
@@ -50,90 +82,268 @@ class FalconReaderThread(threading.Thread):
             last_check_time = time.time()
             log.debug("Current time: %s", last_check_time)
 
-            stats = {'received': 0, 'skipped': 0, 'sent': 0}
-            last_marker_seen = None
-            for batch, last_marker in self.falcon.get_indicators(ts):
-                log.debug("Processing batch of %d indicators", len(batch))
-                if last_marker:
-                    last_marker_seen = last_marker
+            if self.coordinator is not None:
+                ts = self._update_shards(ts, initial_lookback)
+                if not self.owned:
+                    log.info("No shards owned by this replica, sleeping for %d seconds", self.frequency)
+                    time.sleep(self.frequency)
+                    continue
 
-                # Transform and check cache for each indicator - reduce per-indicator logging
-                to_be_sent = []
-                skipped_count = 0
-                for i in batch:
-                    transformed = transform(i)
-                    exists = icache.exists(transformed)
-                    if not exists:
-                        to_be_sent.append(i)
-                    else:
-                        skipped_count += 1
-
-                if skipped_count > 0:
-                    log.debug("Skipped %d indicators that already exist in cache", skipped_count)
-
-                if to_be_sent:
-                    log.debug("Putting %d indicators in queue", len(to_be_sent))
-                    self.queue.put((to_be_sent, last_marker))
-
-                # statistics
-                bsize = len(batch)
-                ssize = len(to_be_sent)
-                stats['received'] += bsize
-                stats['sent'] += ssize
-                stats['skipped'] += (bsize - ssize)
-                log.debug("Batch statistics - received: %d, sent: %d, skipped: %d",
-                          bsize, ssize, bsize - ssize)
-
-            log.info("Statistics: %s | Cache: %s", stats, icache.get_stats())
+            stats = {'received': 0, 'skipped': 0, 'sent': 0, 'refreshed': 0}
+            last_marker_seen = self._read_pages(ts, stats)
+
+            if self.refresh_ttl:
+                with self.profiler.section():
+                    self._refresh_stale(stats)
+
+            if self.budget is not None:
+                log.info("Statistics: %s | Cache: %s | Budget: %s", stats, self.icache.get_stats(), self.budget.get_stats())
+            else:
+                log.info("Statistics: %s | Cache: %s", stats, self.icache.get_stats())
             ts = last_marker_seen if last_marker_seen is not None else last_check_time
             log.debug("Completed fetch cycle, next resume point: %s", ts)
 
             log.debug("Sleeping for %d seconds before next fetch cycle", self.frequency)
             time.sleep(self.frequency)
 
+    def _read_pages(self, ts, stats):
+        """Process all pages of indicators updated since ts; return the last marker seen, if any."""
+        last_marker_seen = None
+        batches = self.falcon.get_indicators(ts)
+        while True:
+            trace = self.tracer.start_trace()
+            with self.profiler.section():
+                with trace.span('fetch') as span:
+                    fetched = next(batches, None)
+                    if fetched is not None:
+                        trace.marker = fetched[1]
+                        span.attributes['indicators'] = len(fetched[0])
+                if fetched is None:
+                    return last_marker_seen
+                batch, last_marker = fetched
+                if last_marker:
+                    last_marker_seen = last_marker
+                self._process_batch(batch, last_marker, stats, trace)
+
+    def _update_shards(self, ts, initial_lookback):
+        """Pick up shard ownership changes and return the point to resume reading from.
+
+        Reading rewinds to the oldest marker of the owned shards whenever a shard was
+        gained, or to the initial lookback if a gained shard has no marker yet.
+        """
+        owned = self.coordinator.owned
+        gained = owned - self.owned
+        self.owned = owned
+        if not gained:
+            return ts
+
+        self.shard_markers = self.coordinator.load_markers(owned)
+        if len(self.shard_markers) < len(owned):
+            ts = time.time() - initial_lookback
+        else:
+            ts = min(self.shard_markers.values())
+        log.info("Took over shards %s, resuming from: %s", sorted(gained), ts)
+        return ts
+
+    def _in_shards(self, indicator, shards):
+        """Return True if the indicator belongs to one of the given shards and was not sent for it yet."""
+        shard = shard_of(indicator['id'], self.coordinator.shards)
+        if shard not in shards:
+            return False
+        marker = self.shard_markers.get(shard)
+        return marker is None or indicator.get('_marker', '') > marker
+
+    def _owns(self, indicator_id):
+        """Return True if the indicator belongs to one of the shards owned by this replica."""
+        return shard_of(indicator_id, self.coordinator.shards) in self.owned
+
+    def _refresh_budget(self):
+        """Return how many indicators to re-publish this cycle.
+
+        Spreads re-publication of all tracked indicators evenly over the refresh TTL
+        instead of re-sending them in one burst, capped at refresh_max_per_cycle.
+        """
+        cycles_per_ttl = max(self.refresh_ttl // self.frequency, 1)
+        return min(-(-self.icache.tracked() // cycles_per_ttl), self.refresh_max_per_cycle)
+
+    def _refresh_stale(self, stats):
+        """Re-publish indicators last sent more than refresh_ttl seconds ago."""
+        # Fresh indicators go first: skip the refresh while the writer is still busy with them,
+        # or while the previous refresh has not been sent yet
+        if self.queue.qsize(FRESH) > self.queue.maxsize // 2 or self.queue.qsize(REFRESH):
+            log.debug("Writer is busy, postponing refresh of stale indicators")
+            return
+
+        # Filter before the limit: digests of shards handed over to other replicas stay behind
+        # as the oldest entries and would otherwise take up the whole budget
+        ids = self.icache.stale(time.time() - self.refresh_ttl, self._refresh_budget(),
+                                self._owns if self.coordinator is not None else None)
+        if not ids:
+            return
+
+        try:
+            indicators = self.falcon.get_indicators_by_ids(ids)
+        except Exception:  # pylint: disable=W0703
+            log.exception("Could not fetch stale indicators for refresh")
+            return
+
+        to_be_sent = []
+        digests = {}
+        for i in indicators:
+            if i.get('deleted'):
+                continue
+            transformed = transform(i)
+            iid, content_hash = self.icache.digest(transformed)
+            digests[iid] = content_hash
+            to_be_sent.append(transformed)
+
+        # Indicators deleted or gone from Falcon are not re-published; forget them instead of retrying
+        gone = set(ids) - set(digests)
+        if gone:
+            log.debug("Forgetting %d indicators no longer available in Falcon", len(gone))
+            self.icache.forget(gone)
+
+        if to_be_sent:
+            log.debug("Putting %d stale indicators in queue for refresh", len(to_be_sent))
+            self.queue.put(REFRESH, to_be_sent, digests)
+        stats['refreshed'] += len(to_be_sent)
+
+    def _split_lanes(self, indicators, digests):
+        """Split indicators and their digests into a dict of lane to (indicators, digests)."""
+        now = time.time()
+        parts = {}
+        for i in indicators:
+            lane_indicators, lane_digests = parts.setdefault(self.lane_policy.lane_of(i, now), ([], {}))
+            lane_indicators.append(i)
+            if i['id'] in digests:
+                lane_digests[i['id']] = digests[i['id']]
+        return parts
+
+    def _process_batch(self, batch, last_marker, stats, trace=NOOP_TRACE):
+        log.debug("Processing batch of %d indicators", len(batch))
+        bsize = len(batch)
+
+        shards = None
+        if self.coordinator is not None:
+            # Leases lost mid-cycle take effect right away, shards gained wait for the next cycle
+            shards = self.owned & self.coordinator.owned
+            batch = [i for i in batch if self._in_shards(i, shards)]
+            log.debug("%d indicators belong to shards owned by this replica", len(batch))
+
+        with trace.span('transform', indicators=len(batch)):
+            transformed = [transform(i) for i in batch]
+
+        # Check cache for each indicator - reduce per-indicator logging
+        to_be_sent = []
+        skipped_count = 0
+        with trace.span('dedup') as span:
+            self.icache.prefetch([i['id'] for i in transformed])
+            for i in transformed:
+                if not self.icache.exists(i):
+                    to_be_sent.append(i)
+                else:
+                    skipped_count += 1
+            span.attributes['skipped'] = skipped_count
+
+        if skipped_count > 0:
+            log.debug("Skipped %d indicators that already exist in cache", skipped_count)
+
+        # Digests are only persisted by the writer once the indicators were sent
+        digests = self.icache.take_unsaved()
+        if to_be_sent:
+            parts = self._split_lanes(to_be_sent, digests)
+            log.debug("Putting %d indicators in queue: %s", len(to_be_sent),
+                      {lane: len(indicators) for lane, (indicators, _) in parts.items()})
+            with trace.span('queue_put', parts=len(parts)):
+                trace.enqueued_ns = time.time_ns()
+                self.queue.put_page(parts, last_marker, shards, trace)
+
+        # statistics
+        ssize = len(to_be_sent)
+        stats['received'] += bsize
+        stats['sent'] += ssize
+        stats['skipped'] += (bsize - ssize)
+        log.debug("Batch statistics - received: %d, sent: %d, skipped: %d",
+                  bsize, ssize, bsize - ssize)
+
 
 class ChronicleWriterThread(threading.Thread):
     """Thread that sends indicators to Chronicle."""
-    def __init__(self, queue, chronicle, *args, **kwargs):
+    def __init__(self, queue, chronicle, *args, icache=None, profiler=None, coordinator=None, budget=None, tracer=None,
+                 **kwargs):
         super().__init__(*args, **kwargs)
         self.queue = queue
         self.chronicle = chronicle
+        self.icache = icache
+        self.coordinator = coordinator
+        self.budget = budget
+        self.profiler = profiler if profiler is not None else Profiler()
+        self.tracer = tracer if tracer is not None else Tracer()
 
     def run(self):
         log.debug("Starting ChronicleWriterThread")
         while True:
             log.debug("Waiting for indicators from queue")
-            indicators, marker = self.queue.get()
+            indicators, digests, seq, trace = self.queue.get()
             log.debug("Got %d indicators from queue", len(indicators))
-            self._send_indicators(indicators, marker)
+            if trace is None:
+                trace = NOOP_TRACE
+            if trace.enqueued_ns is not None:
+                trace.record('queue_wait', trace.enqueued_ns, indicators=len(indicators))
+            with self.profiler.section():
+                with trace.span('send', indicators=len(indicators)) as span:
+                    sent = self._send_indicators(indicators, digests, trace, span)
+                if not sent:
+                    self._exit_after_failure()
+                # Markers are only saved once this page and all pages before it were sent
+                committed = self.queue.done(seq)
+                if committed is not None:
+                    self._save_marker(*committed)
 
-    def _send_indicators(self, indicators, marker):
+    def _exit_after_failure(self):
+        # The unsent page would hold back the marker for good, so exit and let the
+        # restart policy resume from the last saved marker right away
+        log.critical("Exiting so that unsent indicators are read again from the last saved marker")
+        if self.coordinator is not None:
+            try:
+                self.coordinator.release()
+            except Exception:  # pylint: disable=W0703
+                log.exception("Could not release shard leases")
+        os._exit(1)
+
+    def _send_indicators(self, indicators, digests=None, trace=NOOP_TRACE, parent=None):
+        """Send indicators to Chronicle and save their digests; return False if they could not be sent."""
         count = len(indicators)
         log.debug("Processing %d indicators for sending to Chronicle", count)
 
-        # Chronicle has a limit of 250 indicators per request
-        batch_size = 250
-        num_batches = (count + batch_size - 1) // batch_size  # Ceiling division
+        # Split within the ingestion API's limits on indicators and bytes per request
+        payloads = self.chronicle.prepare_batches(indicators)
+        log.debug("Splitting into %d batches of maximum %d indicators each", len(payloads), self.chronicle.batch_size)
 
-        log.debug("Splitting into %d batches of maximum %d indicators each", num_batches, batch_size)
+        for n, payload in enumerate(payloads, 1):
+            log.debug("Sending batch %d/%d (%d bytes)", n, len(payloads), len(payload))
+            if not self._send_payload(payload, trace, parent):
+                return False
 
-        for i in range(0, count, batch_size):
-            batch = indicators[i:i + batch_size]
-            log.debug("Sending batch %d/%d with %d indicators",
-                      (i // batch_size) + 1, num_batches, len(batch))
-            if not self._send_indicators_batch(batch):
-                return
+        if digests and self.icache is not None:
+            _try_save_digests(self.icache, digests)
+        return True
 
-        if marker:
+    def _save_marker(self, marker, shards):
+        if marker and shards is not None:
+            _try_save_shard_markers(self.coordinator, shards, marker)
+        elif marker:
             _try_save_state(marker)
 
-    def _send_indicators_batch(self, batch):
-        log.debug("Attempting to send batch of %d indicators to Chronicle", len(batch))
-
+    def _send_payload(self, payload, trace=NOOP_TRACE, parent=None):
         for i in range(0, 30):
             try:
                 log.debug("Sending batch to Chronicle (attempt %d/30)", i+1)
-                self.chronicle.send_indicators(batch)
+                if self.budget is not None:
+                    with trace.span('budget_wait', parent=parent, bytes=len(payload)):
+                        self.budget.acquire(len(payload))
+                with trace.span('chronicle_request', parent=parent, attempt=i + 1, bytes=len(payload)):
+                    self.chronicle.send_payload(payload)
                 log.debug("Successfully sent batch to Chronicle")
                 return True
             except Exception:  # pylint: disable=W0703
@@ -148,7 +358,7 @@ class ChronicleWriterThread(threading.Thread):
                 if i == 5:
                     log.info("Recreating HTTP session...")
                     # Refresh the session to handle potential stale connections
-                    self.chronicle.http_session = requests.AuthorizedSession(self.chronicle.credentials)
+                    self.chronicle.reset_session()
 
         log.critical("Could not transmit indicators to Chronicle")
         return False
@@ -0,0 +1,248 @@
+import json
+import os
+import queue
+import random
+import secrets
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from .log import log
+from .version import __version__
+
+
+class Span:
+    """A timed operation within a trace."""
+    def __init__(self, trace_id, name, parent_id=None, attributes=None, start_ns=None):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes or {}
+        self.start_ns = start_ns if start_ns is not None else time.time_ns()
+        self.end_ns = None
+
+    def to_dict(self):
+        """Return the span as a flat dict, as written to the JSONL file."""
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_span_id': self.parent_id,
+            'name': self.name,
+            'start_time_unix_nano': self.start_ns,
+            'end_time_unix_nano': self.end_ns,
+            'duration_ms': round((self.end_ns - self.start_ns) / 1e6, 3),
+            'attributes': self.attributes,
+        }
+
+
+class Trace:
+    """Spans of one Falcon page, from fetch to send, all tagged with the page's marker."""
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self.trace_id = secrets.token_hex(16)
+        self.marker = None
+        self.enqueued_ns = None
+
+    @contextmanager
+    def span(self, name, parent=None, **attributes):
+        """Time the enclosed block; the yielded span's attributes can be added to."""
+        span = Span(self.trace_id, name, parent.span_id if parent is not None else None, attributes)
+        try:
+            yield span
+        except Exception as err:
+            span.attributes['error'] = type(err).__name__
+            raise
+        finally:
+            self.end(span)
+
+    def record(self, name, start_ns, **attributes):
+        """Record a span that started earlier and ends now."""
+        self.end(Span(self.trace_id, name, attributes=attributes, start_ns=start_ns))
+
+    def end(self, span):
+        """End a span and hand it to the exporter."""
+        span.end_ns = time.time_ns()
+        if self.marker is not None:
+            span.attributes['ccib.marker'] = self.marker
+        self.tracer.export(span)
+
+
+class _NoopSpan:
+    span_id = None
+
+    @property
+    def attributes(self):
+        return {}
+
+
+class _NoopTrace:
+    """Stand-in for traces that were not sampled; records nothing."""
+    marker = None
+    enqueued_ns = None
+
+    @contextmanager
+    def span(self, _name, parent=None, **_attributes):  # pylint: disable=W0613
+        yield _NoopSpan()
+
+    def record(self, _name, _start_ns, **_attributes):
+        pass
+
+
+NOOP_TRACE = _NoopTrace()
+
+
+class Tracer:
+    """Starts sampled traces and exports their spans in batches from a background thread.
+
+    Finished spans go through a bounded queue, so a slow or unreachable collector
+    never holds up the reader or the writer; spans are dropped while the queue is full.
+    """
+    BATCH_SIZE = 200
+    FLUSH_INTERVAL = 5
+    MAX_QUEUED = 10000
+
+    def __init__(self, exporter=None, sample_rate=0.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate if exporter is not None else 0.0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=self.MAX_QUEUED)
+        if exporter is not None:
+            threading.Thread(target=self._run, name='TraceExporter', daemon=True).start()
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a tracer from the [tracing] configuration section."""
+        kind = config.get('tracing', 'exporter')
+        if kind == 'jsonl':
+            exporter = JsonlExporter(config.get('tracing', 'file'))
+        elif kind == 'otlp':
+            exporter = OtlpHttpExporter(config.get('tracing', 'endpoint'))
+        else:
+            return cls()
+        log.info("Tracing %s%% of pages to %s", float(config.get('tracing', 'sample_rate')) * 100, exporter)
+        return cls(exporter, float(config.get('tracing', 'sample_rate')))
+
+    def start_trace(self):
+        """Return a new trace, or a no-op trace if this one is not sampled."""
+        if self.sample_rate and random.random() < self.sample_rate:  # nosec B311
+            return Trace(self)
+        return NOOP_TRACE
+
+    def export(self, span):
+        """Queue a finished span for the exporter thread, dropping it if the queue is full."""
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def flush(self, timeout=None):
+        """Wait until the spans queued so far were exported; return False on timeout."""
+        if self.exporter is None:
+            return True
+        flushed = threading.Event()
+        try:
+            self._queue.put(flushed, timeout=timeout)
+        except queue.Full:
+            return False
+        return flushed.wait(timeout)
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.FLUSH_INTERVAL
+        while True:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                item = None
+            if isinstance(item, Span):
+                batch.append(item)
+                if len(batch) < self.BATCH_SIZE and time.monotonic() < deadline:
+                    continue
+            self._export(batch)
+            batch = []
+            deadline = time.monotonic() + self.FLUSH_INTERVAL
+            if item is not None and not isinstance(item, Span):
+                item.set()
+
+    def _export(self, spans):
+        with self._lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            log.warning("Dropped %d spans while the exporter to %s was falling behind", dropped, self.exporter)
+        if not spans:
+            return
+        try:
+            self.exporter.export(spans)
+        except Exception:  # pylint: disable=W0703
+            log.warning("Could not export %d spans to %s", len(spans), self.exporter, exc_info=True)
+
+
+class JsonlExporter:
+    """Appends spans to a file, one JSON object per line."""
+    def __init__(self, path):
+        self.path = path
+        dir_name = os.path.dirname(path)
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+
+    def __str__(self):
+        return self.path
+
+    def export(self, spans):
+        """Write spans to the file."""
+        with open(self.path, 'a', encoding='utf-8') as fh:
+            for span in spans:
+                fh.write(json.dumps(span.to_dict()) + '\n')
+
+
+class OtlpHttpExporter:
+    """Sends spans to an OpenTelemetry collector using OTLP/HTTP with JSON encoding."""
+    TIMEOUT = 5
+
+    def __init__(self, endpoint):
+        if not endpoint.startswith(('http://', 'https://')):
+            raise ValueError(f'OTLP endpoint must be an http(s) URL, got: {endpoint}')
+        self.endpoint = endpoint
+
+    def __str__(self):
+        return self.endpoint
+
+    @staticmethod
+    def _attribute(key, value):
+        if isinstance(value, bool):
+            return {'key': key, 'value': {'boolValue': value}}
+        if isinstance(value, int):
+            return {'key': key, 'value': {'intValue': str(value)}}
+        if isinstance(value, float):
+            return {'key': key, 'value': {'doubleValue': value}}
+        return {'key': key, 'value': {'stringValue': str(value)}}
+
+    def payload(self, spans):
+        """Return the ExportTraceServiceRequest for spans."""
+        return {'resourceSpans': [{
+            'resource': {'attributes': [self._attribute('service.name', 'chronicle-intel-bridge'),
+                                        self._attribute('service.version', __version__)]},
+            'scopeSpans': [{
+                'scope': {'name': 'ccib'},
+                'spans': [{
+                    'traceId': span.trace_id,
+                    'spanId': span.span_id,
+                    'parentSpanId': span.parent_id or '',
+                    'name': span.name,
+                    'kind': 1,
+                    'startTimeUnixNano': str(span.start_ns),
+                    'endTimeUnixNano': str(span.end_ns),
+                    'attributes': [self._attribute(k, v) for k, v in span.attributes.items()],
+                } for span in spans],
+            }],
+        }]}
+
+    def export(self, spans):
+        """Post spans to the collector."""
+        request = urllib.request.Request(self.endpoint, data=json.dumps(self.payload(spans)).encode(),
+                                         headers={'Content-Type': 'application/json'}, method='POST')
+        with urllib.request.urlopen(request, timeout=self.TIMEOUT) as response:  # nosec B310 - scheme checked above
+            response.read()
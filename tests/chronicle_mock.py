@@ -0,0 +1,93 @@
+"""Local stand-in for the Chronicle ingestion APIs and the Google OAuth token endpoint."""
+import base64
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+BATCH_CREATE_PATH = '/v2/unstructuredlogentries:batchCreate'
+LOGS_IMPORT_PATH = ('/v1alpha/projects/test-project/locations/us/instances/test-customer'
+                    '/logTypes/CROWDSTRIKE_IOC/logs:import')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: 'MockChronicle'
+
+    def do_POST(self):  # pylint: disable=C0103
+        raw = self.rfile.read(int(self.headers['Content-Length']))
+        if self.path == '/token':
+            self._reply(200, {'access_token': 'test-token', 'token_type': 'Bearer', 'expires_in': 3600})
+            return
+        if self.headers.get('Content-Encoding') == 'gzip':
+            raw = gzip.decompress(raw)
+        headers = {key.lower(): value for key, value in self.headers.items()}
+        self.server.requests.append({'path': self.path, 'headers': headers, 'body': json.loads(raw)})
+        if self.server.failures:
+            self.server.failures -= 1
+            self._reply(503, {'error': {'code': 503, 'message': 'unavailable'}})
+        elif self.path in (BATCH_CREATE_PATH, LOGS_IMPORT_PATH):
+            self._reply(200, {})
+        else:
+            self._reply(404, {'error': {'code': 404, 'message': 'not found'}})
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):  # pylint: disable=W0221
+        pass
+
+
+class MockChronicle(ThreadingHTTPServer):
+    """Records ingestion requests on 127.0.0.1; the next `failures` requests get a 503."""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.requests = []
+        self.failures = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def url(self, path=''):
+        """Return the URL of a path on the mock server."""
+        return f'http://127.0.0.1:{self.server_port}{path}'
+
+    def stop(self):
+        """Shut the server down."""
+        self.shutdown()
+        self.server_close()
+
+    def entries(self):
+        """Return the log texts of all entries received, in order, for either API."""
+        texts = []
+        for request in self.requests:
+            body = request['body']
+            if 'entries' in body:
+                texts += [entry['log_text'] for entry in body['entries']]
+            else:
+                texts += [base64.b64decode(log['data']).decode() for log in body['inlineSource']['logs']]
+        return texts
+
+    def write_service_account(self, path):
+        """Write a service account key file whose tokens are issued by the mock server."""
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                serialization.NoEncryption()).decode()
+        with open(path, 'w', encoding='utf-8') as fh:
+            json.dump({
+                'type': 'service_account',
+                'project_id': 'test-project',
+                'private_key_id': 'test-key',
+                'private_key': pem,
+                'client_email': 'ccib@test-project.iam.gserviceaccount.com',
+                'client_id': '1',
+                'token_uri': self.url('/token'),
+            }, fh)
+        return path
@@ -0,0 +1,80 @@
+from ccib.budget import IngestionBudget, TokenBucket
+from ccib.config import FigConfig
+
+
+class _FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def _budget(**kwargs):
+    clock = _FakeClock()
+    return IngestionBudget(clock=clock, sleep=clock.sleep, **kwargs), clock
+
+
+class TestTokenBucket:
+    def test_starts_full(self):
+        assert TokenBucket(10, _FakeClock()).wait_time(10) == 0
+
+    def test_refills_at_rate(self):
+        clock = _FakeClock()
+        bucket = TokenBucket(10, clock)
+        bucket.take(10)
+        assert bucket.wait_time(5) == 0.5
+        clock.now += 0.5
+        assert bucket.wait_time(5) == 0
+
+    def test_large_request_goes_into_debt(self):
+        clock = _FakeClock()
+        bucket = TokenBucket(10, clock)
+        assert bucket.wait_time(25) == 0
+        bucket.take(25)
+        assert bucket.wait_time(1) == 1.6
+
+
+class TestIngestionBudget:
+    def test_unlimited_never_waits(self):
+        budget, clock = _budget()
+        for _ in range(100):
+            budget.acquire(1_000_000)
+        assert clock.now == 1000.0
+
+    def test_requests_per_second(self):
+        budget, clock = _budget(requests_per_second=2)
+        for _ in range(6):
+            budget.acquire(100)
+        assert clock.now == 1002.0
+        assert budget.get_stats()['throttled_seconds'] == 2.0
+
+    def test_bytes_per_second(self):
+        budget, clock = _budget(bytes_per_second=1000)
+        for _ in range(4):
+            budget.acquire(500)
+        assert clock.now == 1001.0
+
+    def test_daily_bytes_remaining_reported(self):
+        budget, _ = _budget(daily_bytes=10_000)
+        budget.acquire(4_000)
+        stats = budget.get_stats()
+        assert stats['daily_bytes_remaining'] == 6_000
+        assert stats['requests_per_second'] == round(1 / 60, 2)
+
+    def test_daily_cap_blocks_until_tomorrow(self):
+        budget, _ = _budget(daily_bytes=10_000)
+        budget.acquire(8_000)
+        # pylint: disable-next=protected-access
+        assert budget._wait_time(4_000) > 0
+
+
+def test_from_config_accepts_what_validation_accepts(tmp_path):
+    path = tmp_path / 'budget.ini'
+    path.write_text('[budget]\nrequests_per_second = 0\nbytes_per_second = 0\ndaily_bytes = 1e9\n')
+    config = FigConfig(files=[str(path)])
+    config.validate_budget()
+    assert IngestionBudget.from_config(config).daily_bytes == 1_000_000_000
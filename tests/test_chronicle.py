@@ -0,0 +1,137 @@
+import base64
+import datetime
+import gzip
+import json
+
+import pytest
+import requests
+
+from ccib.chronicle import BatchCreateBackend, Chronicle, LogsImportBackend, TokenRefresherThread, build_session, encode_body
+from .chronicle_mock import BATCH_CREATE_PATH, LOGS_IMPORT_PATH, MockChronicle
+
+
+class _FakeCredentials:
+    def __init__(self, expiry=None):
+        self.expiry = expiry
+        self.refreshed = 0
+
+    def refresh(self, request):  # pylint: disable=unused-argument
+        self.refreshed += 1
+        self.expiry = datetime.datetime.utcnow() + datetime.timedelta(hours=1)
+
+
+def _refresher(expiry, margin=600):
+    return TokenRefresherThread(_FakeCredentials(expiry), margin)
+
+
+class TestTokenRefresher:
+    def test_refresh_immediately_without_token(self):
+        assert _refresher(None).seconds_until_refresh() == 0
+
+    def test_refresh_ahead_of_expiry(self):
+        expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=3600)
+        delay = _refresher(expiry, margin=600).seconds_until_refresh()
+        assert 2990 < delay <= 3000
+
+    def test_refresh_immediately_within_margin(self):
+        expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=300)
+        assert _refresher(expiry, margin=600).seconds_until_refresh() == 0
+
+    def test_refresh_updates_expiry(self):
+        refresher = _refresher(None)
+        refresher.refresh()
+        assert refresher.credentials.refreshed == 1
+        assert refresher.seconds_until_refresh() > 0
+
+
+class TestBuildSession:
+    def test_pool_sized_to_writers(self):
+        session = build_session(_FakeCredentials(), pool_size=8)
+        adapter = session.get_adapter('https://malachiteingestion-pa.googleapis.com')
+        assert adapter._pool_maxsize == 8  # pylint: disable=protected-access
+        assert adapter.max_retries.total == 0
+
+
+@pytest.fixture(name='mock_chronicle')
+def fixture_mock_chronicle():
+    server = MockChronicle()
+    yield server
+    server.stop()
+
+
+def _chronicle(mock_chronicle, tmp_path, path, **kwargs):
+    service_account = mock_chronicle.write_service_account(str(tmp_path / 'sa.json'))
+    return Chronicle('test-customer', service_account, '', token_refresh_margin=0,
+                     endpoint=mock_chronicle.url(path), **kwargs)
+
+
+def _indicators(count):
+    return [{'id': f'domain_{n}', 'type': 'domain', 'indicator': f'{n}.example.com', 'published_date': 1700000000}
+            for n in range(count)]
+
+
+class TestBackends:
+    def test_batch_create_defaults_to_us(self):
+        assert BatchCreateBackend('cid', '').endpoint == \
+            'https://malachiteingestion-pa.googleapis.com/v2/unstructuredlogentries:batchCreate'
+        assert BatchCreateBackend('cid', 'EUROPE-WEST2').endpoint.startswith('https://europe-west2-malachiteingestion')
+
+    def test_logs_import_endpoint(self):
+        assert LogsImportBackend('cid', 'EU', 'proj').endpoint == (
+            'https://europe-chronicle.googleapis.com/v1alpha/projects/proj/locations/europe/instances/cid'
+            '/logTypes/CROWDSTRIKE_IOC/logs:import')
+        assert '/locations/us/instances/inst/' in LogsImportBackend('cid', '', 'proj', 'inst').endpoint
+
+    def test_logs_import_entry(self):
+        entry = LogsImportBackend('cid', 'US', 'proj').entry('{"id": "x"}', 1700000000_000001)
+        assert base64.b64decode(entry['data']) == b'{"id": "x"}'
+        assert entry['logEntryTime'] == '2023-11-14T22:13:20.000001Z'
+
+    def test_encode_body_compresses(self):
+        body = {'entries': ['x' * 1000]}
+        assert gzip.decompress(encode_body(body, compress=True)) == encode_body(body)
+
+
+class TestChronicle:
+    def test_batch_create(self, mock_chronicle, tmp_path):
+        chronicle = _chronicle(mock_chronicle, tmp_path, BATCH_CREATE_PATH)
+        chronicle.send_indicators(_indicators(600))
+
+        assert [len(r['body']['entries']) for r in mock_chronicle.requests] == [250, 250, 100]
+        request = mock_chronicle.requests[0]
+        assert request['headers']['authorization'] == 'Bearer test-token'
+        assert request['body']['customer_id'] == 'test-customer'
+        assert request['body']['log_type'] == 'CROWDSTRIKE_IOC'
+        assert request['body']['entries'][0]['ts_epoch_microseconds'] == 1700000000_000000
+        assert [json.loads(text)['id'] for text in mock_chronicle.entries()] == [i['id'] for i in _indicators(600)]
+
+    def test_logs_import_compressed(self, mock_chronicle, tmp_path):
+        chronicle = _chronicle(mock_chronicle, tmp_path, LOGS_IMPORT_PATH, ingestion_api='logs_import',
+                               project_id='test-project', compress=True)
+        chronicle.send_indicators(_indicators(5000))
+
+        assert [len(r['body']['inlineSource']['logs']) for r in mock_chronicle.requests] == [4000, 1000]
+        assert mock_chronicle.requests[0]['headers']['content-encoding'] == 'gzip'
+        assert json.loads(mock_chronicle.entries()[0]) == _indicators(1)[0]
+
+    def test_batches_respect_byte_limit(self, mock_chronicle, tmp_path):
+        chronicle = _chronicle(mock_chronicle, tmp_path, BATCH_CREATE_PATH)
+        chronicle.backend.MAX_BYTES = 5000
+        payloads = chronicle.prepare_batches(_indicators(100))
+
+        assert len(payloads) > 1
+        assert all(len(payload) <= 5000 for payload in payloads)
+        assert sum(len(json.loads(payload)['entries']) for payload in payloads) == 100
+
+    def test_batch_size_caps_entries(self, mock_chronicle, tmp_path):
+        chronicle = _chronicle(mock_chronicle, tmp_path, BATCH_CREATE_PATH, batch_size=100)
+        assert len(chronicle.prepare_batches(_indicators(250))) == 3
+        assert _chronicle(mock_chronicle, tmp_path, BATCH_CREATE_PATH, batch_size=1000).batch_size == 250
+
+    def test_error_status_raises(self, mock_chronicle, tmp_path):
+        chronicle = _chronicle(mock_chronicle, tmp_path, BATCH_CREATE_PATH)
+        mock_chronicle.failures = 1
+        with pytest.raises(requests.HTTPError):
+            chronicle.send_payload(chronicle.prepare_batches(_indicators(1))[0])
+        chronicle.send_payload(chronicle.prepare_batches(_indicators(1))[0])
+        assert len(mock_chronicle.requests) == 2
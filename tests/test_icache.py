@@ -1,4 +1,7 @@
+import time
+
 from ccib.icache import ICache
+from ccib.store import SQLiteStore
 
 
 def _make_indicator(iid='ind-1', value='1.2.3.4', labels=None, relations=None,
@@ -130,3 +133,76 @@ class TestICacheStats:
             cache.exists(_make_indicator(iid=f'ind-{i}'))
         stats = cache.get_stats()
         assert stats == {'size': 5, 'max_size': 5, 'evictions': 2}
+
+
+class TestICacheStore:
+    def test_unsaved_digests_not_persisted(self, tmp_path):
+        store = SQLiteStore(str(tmp_path / 'ccib.db'))
+        cache = ICache(store=store)
+        cache.exists(_make_indicator())
+        assert store.count_digests() == 0
+        assert ICache(store=store).exists(_make_indicator()) is False
+
+    def test_saved_digests_survive_restart(self, tmp_path):
+        store = SQLiteStore(str(tmp_path / 'ccib.db'))
+        cache = ICache(store=store)
+        cache.exists(_make_indicator(iid='ind-0'))
+        cache.exists(_make_indicator(iid='ind-1'))
+        cache.save(cache.take_unsaved())
+        restarted = ICache(store=store)
+        restarted.prefetch(['ind-0', 'ind-1', 'ind-2'])
+        assert restarted.exists(_make_indicator(iid='ind-0')) is True
+        assert restarted.exists(_make_indicator(iid='ind-1', value='5.6.7.8')) is False
+        assert restarted.exists(_make_indicator(iid='ind-2')) is False
+        assert set(restarted.take_unsaved()) == {'ind-1', 'ind-2'}
+
+    def test_hot_set_bounded_by_max_size(self, tmp_path):
+        store = SQLiteStore(str(tmp_path / 'ccib.db'))
+        cache = ICache(max_size=2, store=store)
+        for i in range(5):
+            cache.exists(_make_indicator(iid=f'ind-{i}'))
+        cache.save(cache.take_unsaved())
+        assert len(cache.cache) == 2
+        assert cache.exists(_make_indicator(iid='ind-0')) is True
+        assert cache.get_stats() == {'size': 2, 'max_size': 2, 'evictions': 4, 'stored': 5}
+
+
+class TestICacheRefresh:
+    def test_only_sent_indicators_are_tracked(self):
+        cache = ICache()
+        cache.exists(_make_indicator(iid='ind-0'))
+        cache.exists(_make_indicator(iid='ind-1'))
+        cache.save({'ind-0': cache.take_unsaved()['ind-0']})
+        assert cache.tracked() == 1
+        assert cache.stale(time.time() + 1, 10) == ['ind-0']
+
+    def test_stale_returns_oldest_first_up_to_limit(self):
+        cache = ICache()
+        for i in range(3):
+            cache.exists(_make_indicator(iid=f'ind-{i}'))
+        unsaved = cache.take_unsaved()
+        for iid in ('ind-2', 'ind-0', 'ind-1'):
+            cache.save({iid: unsaved[iid]})
+        assert cache.stale(time.time() + 1, 2) == ['ind-2', 'ind-0']
+        assert not cache.stale(time.time() - 60, 10)
+
+    def test_forget_and_evict_stop_tracking(self):
+        cache = ICache(max_size=2)
+        for i in range(2):
+            cache.exists(_make_indicator(iid=f'ind-{i}'))
+        cache.save(cache.take_unsaved())
+        cache.forget(['ind-0'])
+        cache.exists(_make_indicator(iid='ind-2'))
+        cache.exists(_make_indicator(iid='ind-3'))
+        assert cache.tracked() == 0
+
+    def test_stale_from_store(self, tmp_path):
+        store = SQLiteStore(str(tmp_path / 'ccib.db'))
+        store.put_digests({'ind-0': 'a'}, sent_at=100)
+        store.put_digests({'ind-1': 'b'}, sent_at=50)
+        store.put_digests({'ind-2': 'c'}, sent_at=300)
+        cache = ICache(store=store)
+        assert cache.stale(200, 10) == ['ind-1', 'ind-0']
+        assert cache.stale(400, 1, keep=lambda iid: iid != 'ind-1') == ['ind-0']
+        cache.forget(['ind-1'])
+        assert cache.tracked() == 2
@@ -0,0 +1,51 @@
+from ccib.lanes import BACKFILL, FRESH, REFRESH, LanePolicy, LaneQueue
+
+NOW = 1_700_000_000
+
+
+class TestLanePolicy:
+    def test_high_confidence_is_fresh(self):
+        policy = LanePolicy()
+        assert policy.lane_of({'malicious_confidence': 'high', 'published_date': 0}, NOW) == FRESH
+
+    def test_recently_published_is_fresh(self):
+        policy = LanePolicy(max_age=3600)
+        assert policy.lane_of({'malicious_confidence': 'low', 'published_date': NOW - 60}, NOW) == FRESH
+        assert policy.lane_of({'malicious_confidence': 'low', 'published_date': NOW - 7200}, NOW) == BACKFILL
+
+    def test_type_is_fresh(self):
+        policy = LanePolicy(confidences=(), max_age=0, types=('domain',))
+        assert policy.lane_of({'type': 'domain'}, NOW) == FRESH
+        assert policy.lane_of({'type': 'ip_address'}, NOW) == BACKFILL
+
+
+class TestLaneQueue:
+    def test_weighted_fair_scheduling(self):
+        queue = LaneQueue({FRESH: 3, BACKFILL: 1}, maxsize=100)
+        for i in range(8):
+            queue.put(FRESH, [f'f{i}'], {})
+            queue.put(BACKFILL, [f'b{i}'], {})
+        served = [queue.get()[0][0][0] for _ in range(8)]
+        assert served.count('f') == 6
+        assert served.count('b') == 2
+
+    def test_empty_lanes_do_not_hold_back_others(self):
+        queue = LaneQueue({FRESH: 8, BACKFILL: 2, REFRESH: 1})
+        queue.put(REFRESH, ['r'], {})
+        assert queue.get() == (['r'], {}, None, None)
+
+    def test_markers_committed_in_order(self):
+        queue = LaneQueue({FRESH: 8, BACKFILL: 1})
+        queue.put_page({BACKFILL: (['b1'], {}), FRESH: (['f1'], {})}, 'marker-1')
+        queue.put_page({FRESH: (['f2'], {})}, 'marker-2', {0})
+        parts = [queue.get() for _ in range(3)]
+        seqs = {indicators[0]: seq for indicators, _, seq, _ in parts}
+        assert queue.done(seqs['f1']) is None
+        assert queue.done(seqs['f2']) is None
+        assert queue.done(seqs['b1']) == ('marker-2', {0})
+        assert queue.qsize() == 0
+
+    def test_refresh_parts_do_not_commit_markers(self):
+        queue = LaneQueue({REFRESH: 1})
+        queue.put(REFRESH, ['r'], {'r': 'digest'})
+        assert queue.done(queue.get()[2]) is None
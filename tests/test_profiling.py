@@ -0,0 +1,132 @@
+import pstats
+import threading
+import time
+import tracemalloc
+import urllib.request
+
+from ccib.profiling import Profiler, heap_snapshot, start_http_endpoint
+
+
+def _wait_for(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_section_is_noop_without_session(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    with profiler.section():
+        sum(range(1000))
+    assert not profiler.active
+    assert not list(tmp_path.iterdir())
+
+
+def test_session_dumps_profile_per_thread(tmp_path):
+    profiler = Profiler(str(tmp_path), top=5)
+    assert profiler.start(duration=60) is True
+    assert profiler.start() is False
+    with profiler.section():
+        sum(range(1000))
+    profiler.stop()
+    assert not profiler.active
+    names = sorted(p.name for p in tmp_path.iterdir())
+    assert len(names) == 2
+    assert names[0].endswith('-MainThread.prof' if Profiler.PER_THREAD else '-all-threads.prof')
+    assert 'cumulative' in (tmp_path / names[1]).read_text()
+
+
+def test_session_ends_after_duration(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    profiler.start(duration=0.1)
+    assert _wait_for(lambda: not profiler.active)
+
+
+def test_stale_timer_does_not_end_next_session(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    profiler.start(duration=60)
+    profiler.stop()
+    profiler.start(duration=60)
+    profiler._finish('an earlier session')  # pylint: disable=protected-access
+    assert profiler.active
+    profiler.stop()
+
+
+def _reader_work():
+    return sum(range(1000))
+
+
+def _writer_work():
+    return sum(range(1000))
+
+
+def _profiled_functions(path):
+    return {func[2] for func in pstats.Stats(str(path)).stats}
+
+
+def test_concurrent_sections(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    profiler.start(duration=60)
+    both_inside = threading.Barrier(2, timeout=5)
+    errors = []
+
+    def work(func):
+        try:
+            with profiler.section():
+                both_inside.wait()
+                func()
+        except Exception as err:  # pylint: disable=W0703
+            errors.append(err)
+
+    threads = [threading.Thread(target=work, args=(func,), name=name)
+               for name, func in (('Reader', _reader_work), ('Writer', _writer_work))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    profiler.stop()
+
+    assert not errors
+    profiles = {p.name.split('-')[-1]: p for p in tmp_path.iterdir() if p.name.endswith('.prof')}
+    if Profiler.PER_THREAD:
+        assert set(profiles) == {'Reader.prof', 'Writer.prof'}
+        assert '_reader_work' in _profiled_functions(profiles['Reader.prof'])
+        assert '_writer_work' not in _profiled_functions(profiles['Reader.prof'])
+        assert '_writer_work' in _profiled_functions(profiles['Writer.prof'])
+    else:
+        assert set(profiles) == {'threads.prof'}
+        assert {'_reader_work', '_writer_work'} <= _profiled_functions(profiles['threads.prof'])
+
+
+def test_heap_snapshot_writes_top_allocations(tmp_path):
+    tracemalloc.start()
+    try:
+        path = heap_snapshot(str(tmp_path), top=3)
+    finally:
+        tracemalloc.stop()
+    content = open(path, encoding='utf-8').read()
+    assert content.startswith('Traced memory:')
+
+
+def test_first_heap_snapshot_only_starts_tracing(tmp_path):
+    try:
+        assert heap_snapshot(str(tmp_path)) is None
+        assert tracemalloc.is_tracing()
+        assert heap_snapshot(str(tmp_path)) is not None
+    finally:
+        tracemalloc.stop()
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_http_endpoint_starts_session(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    server = start_http_endpoint(profiler, 0)
+    try:
+        url = f'http://127.0.0.1:{server.server_address[1]}/profile?seconds=1'
+        with urllib.request.urlopen(urllib.request.Request(url, method='POST')) as resp:  # nosec B310
+            assert resp.status == 202
+        assert profiler.active
+    finally:
+        server.shutdown()
@@ -0,0 +1,68 @@
+import subprocess
+import sys
+import time
+
+from ccib.shards import ShardCoordinator, shard_of
+
+
+def _coordinator(tmp_path, replica_id, shards=8, lease_ttl=60):
+    return ShardCoordinator(str(tmp_path / 'shards.db'), shards, replica_id=replica_id, lease_ttl=lease_ttl)
+
+
+def test_shard_of_is_stable():
+    assert shard_of('domain_example.com', 8) == shard_of('domain_example.com', 8)
+    assert {shard_of(f'ind-{i}', 8) for i in range(200)} == set(range(8))
+
+
+def test_single_replica_owns_all_shards(tmp_path):
+    assert _coordinator(tmp_path, 'a').claim() == frozenset(range(8))
+
+
+def test_shards_rebalance_when_replica_joins(tmp_path):
+    first = _coordinator(tmp_path, 'a')
+    second = _coordinator(tmp_path, 'b')
+    first.claim()
+    assert second.claim() == frozenset()
+    first.claim()
+    second.claim()
+    assert len(first.owned) == 4
+    assert len(second.owned) == 4
+    assert first.owned.isdisjoint(second.owned)
+
+
+def test_failover_after_lease_expiry(tmp_path):
+    first = _coordinator(tmp_path, 'a', lease_ttl=0.2)
+    second = _coordinator(tmp_path, 'b', lease_ttl=0.2)
+    first.claim()
+    second.claim()
+    first.claim()
+    second.claim()
+    time.sleep(0.3)
+    assert second.claim() == frozenset(range(8))
+
+
+def test_markers_saved_only_for_owned_shards(tmp_path):
+    first = _coordinator(tmp_path, 'a', shards=2)
+    second = _coordinator(tmp_path, 'b', shards=2)
+    first.claim()
+    second.claim()
+    first.claim()
+    second.claim()
+    first.save_markers({0, 1}, 'marker-1')
+    assert first.load_markers({0, 1}) == {shard: 'marker-1' for shard in first.owned}
+
+
+def test_sigterm_releases_leases(tmp_path):
+    path = tmp_path / 'shards.db'
+    script = (
+        "import os, signal, time\n"
+        "from ccib.shards import ShardCoordinator, install_release_handler\n"
+        f"coordinator = ShardCoordinator({str(path)!r}, 8, replica_id='a')\n"
+        "coordinator.claim()\n"
+        "install_release_handler(coordinator)\n"
+        "os.kill(os.getpid(), signal.SIGTERM)\n"
+        "time.sleep(10)\n"
+    )
+    result = subprocess.run([sys.executable, '-c', script], timeout=20, check=False)
+    assert result.returncode == 0
+    assert _coordinator(tmp_path, 'b').claim() == frozenset(range(8))
@@ -0,0 +1,28 @@
+import subprocess
+import sys
+
+HEAVY_MODULES = ('falconpy', 'google.auth', 'google.oauth2', 'requests')
+
+
+def _run(*args):
+    return subprocess.run([sys.executable, *args], capture_output=True, text=True, check=False, timeout=60)
+
+
+def test_import_does_not_load_sdks():
+    code = ("import sys, ccib.__main__; "
+            f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+    result = _run('-c', code)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ''
+
+
+def test_import_does_not_read_config():
+    result = _run('-c', "import ccib.__main__, ccib.config; print(ccib.config.get_config.cache_info().currsize)")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == '0'
+
+
+def test_help_exits_cleanly():
+    result = _run('-m', 'ccib', '--help')
+    assert result.returncode == 0, result.stderr
+    assert 'usage: ccib' in result.stdout
@@ -0,0 +1,25 @@
+from ccib.store import SQLiteStore
+
+
+def test_wal_mode(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'ccib.db'))
+    assert store._conn().execute('PRAGMA journal_mode').fetchone()[0] == 'wal'  # pylint: disable=protected-access
+
+
+def test_state_round_trip(tmp_path):
+    path = str(tmp_path / 'ccib.db')
+    store = SQLiteStore(path)
+    assert store.load_state() is None
+    store.save_state({'last_marker': 'abc', 'count': 3})
+    store.save_state({'last_marker': 'def'})
+    assert SQLiteStore(path).load_state() == {'last_marker': 'def'}
+
+
+def test_digest_upsert_and_lookup(tmp_path):
+    store = SQLiteStore(str(tmp_path / 'ccib.db'))
+    store.put_digests({f'ind-{i}': 'a' for i in range(1200)})
+    store.put_digests({'ind-0': 'b'})
+    found = store.get_digests(['ind-0', 'ind-1', 'ind-1199', 'missing'])
+    assert found == {'ind-0': 'b', 'ind-1': 'a', 'ind-1199': 'a'}
+    assert len(store.get_digests(f'ind-{i}' for i in range(1200))) == 1200
+    assert store.count_digests() == 1200
@@ -0,0 +1,253 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+from ccib.icache import ICache
+from ccib.lanes import LaneQueue
+from ccib.shards import ShardCoordinator, shard_of
+from ccib.store import SQLiteStore
+from ccib.threads import ChronicleWriterThread, FalconReaderThread
+
+
+def _indicator(iid, marker='m5', **fields):
+    return {'id': iid, 'indicator': iid, 'type': 'domain', 'malicious_confidence': 'high', '_marker': marker,
+            'last_updated': 1700000000, 'labels': [], 'relations': [], **fields}
+
+
+def _queue():
+    return LaneQueue({'fresh': 1, 'backfill': 1, 'refresh': 1})
+
+
+def _drain(queue):
+    parts = []
+    while queue.qsize():
+        parts.append(queue.get())
+    return parts
+
+
+def _reader(queue, coordinator=None, falcon=None):
+    return FalconReaderThread(falcon, queue, ICache(), coordinator=coordinator)
+
+
+def _ids_by_shard(shards, per_shard=2):
+    by_shard = {}
+    n = 0
+    while any(len(by_shard.get(shard, [])) < per_shard for shard in range(shards)):
+        iid = f'ind-{n}'
+        by_shard.setdefault(shard_of(iid, shards), []).append(iid)
+        n += 1
+    return {shard: ids[:per_shard] for shard, ids in by_shard.items()}
+
+
+class TestReaderSharding:
+    def _coordinator(self, tmp_path):
+        coordinator = ShardCoordinator(str(tmp_path / 'shards.db'), 4, replica_id='a')
+        coordinator.claim()
+        return coordinator
+
+    def test_rewinds_to_oldest_shard_marker(self, tmp_path):
+        coordinator = self._coordinator(tmp_path)
+        for shard, marker in enumerate(['m3', 'm1', 'm4', 'm2']):
+            coordinator.save_markers([shard], marker)
+        reader = _reader(_queue(), coordinator)
+        assert reader._update_shards('m9', 3600) == 'm1'  # pylint: disable=protected-access
+        assert reader.shard_markers == {0: 'm3', 1: 'm1', 2: 'm4', 3: 'm2'}
+        # Nothing gained on the next cycle: keep going from where reading stopped
+        assert reader._update_shards('m9', 3600) == 'm9'  # pylint: disable=protected-access
+
+    def test_rewinds_to_lookback_for_shard_without_marker(self, tmp_path):
+        coordinator = self._coordinator(tmp_path)
+        coordinator.save_markers([0, 1, 2], 'm1')
+        reader = _reader(_queue(), coordinator)
+        ts = reader._update_shards('m9', 3600)  # pylint: disable=protected-access
+        assert abs(ts - (time.time() - 3600)) < 5
+
+    def test_skips_indicators_already_sent_for_their_shard(self, tmp_path):
+        coordinator = self._coordinator(tmp_path)
+        ids = _ids_by_shard(4)
+        coordinator.save_markers([0], 'm5')
+        queue = _queue()
+        reader = _reader(queue, coordinator)
+        reader._update_shards('m0', 3600)  # pylint: disable=protected-access
+        batch = [_indicator(ids[0][0], 'm5'), _indicator(ids[0][1], 'm6'), _indicator(ids[1][0], 'm5')]
+        stats = {'received': 0, 'skipped': 0, 'sent': 0, 'refreshed': 0}
+        reader._process_batch(batch, 'm6', stats)  # pylint: disable=protected-access
+
+        (indicators, _, seq, _), = _drain(queue)
+        assert [i['id'] for i in indicators] == [ids[0][1], ids[1][0]]
+        assert stats == {'received': 3, 'skipped': 1, 'sent': 2, 'refreshed': 0}
+        assert queue.done(seq) == ('m6', frozenset(range(4)))
+
+    def test_lost_lease_takes_effect_mid_cycle(self, tmp_path):
+        coordinator = self._coordinator(tmp_path)
+        ids = _ids_by_shard(4, per_shard=1)
+        queue = _queue()
+        reader = _reader(queue, coordinator)
+        reader._update_shards('m0', 3600)  # pylint: disable=protected-access
+        coordinator.owned = frozenset({2, 3})
+        stats = {'received': 0, 'skipped': 0, 'sent': 0, 'refreshed': 0}
+        reader._process_batch([_indicator(ids[shard][0]) for shard in range(4)], 'm5', stats)  # pylint: disable=protected-access
+
+        (indicators, _, seq, _), = _drain(queue)
+        assert [i['id'] for i in indicators] == [ids[2][0], ids[3][0]]
+        # The marker is only saved for the shards still held
+        assert queue.done(seq) == ('m5', frozenset({2, 3}))
+
+
+class _FakeFalcon:
+    def __init__(self, indicators):
+        self.indicators = {i['id']: i for i in indicators}
+        self.requested = []
+
+    def get_indicators_by_ids(self, ids):
+        self.requested.append(list(ids))
+        return [dict(self.indicators[iid]) for iid in ids if iid in self.indicators]
+
+
+class TestReaderRefresh:
+    def _reader(self, queue, falcon, ids, sent_ago=7200):
+        reader = _reader(queue, falcon=falcon)
+        reader.refresh_ttl = 3600
+        reader.frequency = 600
+        for iid in ids:
+            reader.icache.exists(_indicator(iid))
+        reader.icache.save(reader.icache.take_unsaved())
+        for iid in ids:
+            reader.icache.sent_at[iid] = time.time() - sent_ago
+        return reader
+
+    def test_budget_spreads_refresh_over_ttl(self):
+        reader = self._reader(_queue(), _FakeFalcon([]), [f'ind-{n}' for n in range(13)])
+        # 6 cycles per TTL: ceil(13 / 6) indicators per cycle
+        assert reader._refresh_budget() == 3  # pylint: disable=protected-access
+        reader.refresh_max_per_cycle = 2
+        assert reader._refresh_budget() == 2  # pylint: disable=protected-access
+
+    def test_stale_indicators_go_to_refresh_lane_with_digests(self):
+        queue = _queue()
+        falcon = _FakeFalcon([_indicator('ind-0'), _indicator('ind-1', deleted=True)])
+        reader = self._reader(queue, falcon, ['ind-0', 'ind-1', 'ind-2'])
+        reader.frequency = reader.refresh_ttl
+        stats = {'refreshed': 0}
+        reader._refresh_stale(stats)  # pylint: disable=protected-access
+
+        assert falcon.requested == [['ind-0', 'ind-1', 'ind-2']]
+        (indicators, digests, seq, _), = _drain(queue)
+        assert [i['id'] for i in indicators] == ['ind-0']
+        assert '_marker' not in indicators[0]
+        assert digests == {'ind-0': reader.icache.digest(indicators[0])[1]}
+        assert seq is None
+        assert stats == {'refreshed': 1}
+        # Deleted and missing indicators are forgotten instead of being retried every cycle
+        assert reader.icache.tracked() == 1
+
+    def test_recently_sent_indicators_are_not_refreshed(self):
+        queue = _queue()
+        falcon = _FakeFalcon([_indicator('ind-0')])
+        reader = self._reader(queue, falcon, ['ind-0'], sent_ago=60)
+        reader._refresh_stale({'refreshed': 0})  # pylint: disable=protected-access
+        assert not falcon.requested
+        assert not queue.qsize()
+
+    def test_postponed_while_fresh_lane_is_busy(self):
+        queue = _queue()
+        for _ in range(queue.maxsize // 2 + 1):
+            queue.put('fresh', [{}], {})
+        falcon = _FakeFalcon([_indicator('ind-0')])
+        reader = self._reader(queue, falcon, ['ind-0'])
+        reader._refresh_stale({'refreshed': 0})  # pylint: disable=protected-access
+        assert not falcon.requested
+
+    def test_backfill_does_not_postpone_refresh(self):
+        queue = _queue()
+        for _ in range(queue.maxsize):
+            queue.put('backfill', [{}], {})
+        falcon = _FakeFalcon([_indicator('ind-0')])
+        reader = self._reader(queue, falcon, ['ind-0'])
+        reader._refresh_stale({'refreshed': 0})  # pylint: disable=protected-access
+        assert falcon.requested == [['ind-0']]
+
+    def test_postponed_while_previous_refresh_is_queued(self):
+        queue = _queue()
+        queue.put('refresh', [{}], {})
+        falcon = _FakeFalcon([_indicator('ind-0')])
+        reader = self._reader(queue, falcon, ['ind-0'])
+        reader._refresh_stale({'refreshed': 0})  # pylint: disable=protected-access
+        assert not falcon.requested
+
+    def _sharded_reader(self, icache, falcon, lost, owned):
+        reader = FalconReaderThread(falcon, _queue(), icache, coordinator=SimpleNamespace(shards=2, owned=frozenset({0})))
+        reader.owned = frozenset({0})
+        reader.refresh_ttl = reader.frequency = 3600
+        reader.refresh_max_per_cycle = 3
+        # Digests of the revoked shard are older than those of the shard still owned
+        for iid, sent_at in [(iid, 1000) for iid in lost] + [(iid, 2000) for iid in owned]:
+            icache.exists(_indicator(iid))
+            icache.save({iid: icache.take_unsaved()[iid]})
+            if icache.store is not None:
+                icache.store.put_digests({iid: icache.cache[iid]}, sent_at=sent_at)
+            else:
+                icache.sent_at[iid] = sent_at
+        return reader
+
+    def _check_revoked_shard(self, icache):
+        ids = _ids_by_shard(2, per_shard=4)
+        falcon = _FakeFalcon([_indicator(iid) for iid in ids[0]])
+        reader = self._sharded_reader(icache, falcon, ids[1], ids[0])
+        stats = {'refreshed': 0}
+        reader._refresh_stale(stats)  # pylint: disable=protected-access
+        assert falcon.requested == [ids[0][:3]]
+        assert stats == {'refreshed': 3}
+
+    def test_revoked_shard_does_not_starve_refresh(self):
+        self._check_revoked_shard(ICache())
+
+    def test_revoked_shard_does_not_starve_refresh_from_store(self, tmp_path):
+        self._check_revoked_shard(ICache(store=SQLiteStore(str(tmp_path / 'ccib.db'))))
+
+
+class _FakeChronicle:
+    batch_size = 250
+
+    def prepare_batches(self, indicators):
+        return [json.dumps(indicators).encode()]
+
+
+class TestWriter:
+    def test_failed_send_exits_without_saving_marker(self, monkeypatch):
+        queue = _queue()
+        saved = []
+        exited = threading.Event()
+        codes = []
+
+        class _Coordinator:
+            released = False
+
+            def release(self):
+                self.released = True
+
+        def fake_exit(code):
+            codes.append(code)
+            exited.set()
+            # Park the writer where the process would have ended
+            threading.Event().wait()
+
+        coordinator = _Coordinator()
+        writer = ChronicleWriterThread(queue, _FakeChronicle(), icache=ICache(), coordinator=coordinator,
+                                       daemon=True)
+        # Stands in for 30 failed attempts against Chronicle
+        writer._send_payload = lambda payload, *args: b'unsendable' not in payload  # pylint: disable=protected-access
+        writer._save_marker = lambda marker, shards: saved.append(marker)  # pylint: disable=protected-access
+
+        queue.put_page({'fresh': ([{'id': 'ok-1'}], {'ok-1': 'd'})}, 'marker-1')
+        queue.put_page({'fresh': ([{'id': 'unsendable'}], {'unsendable': 'd'})}, 'marker-2')
+        queue.put_page({'fresh': ([{'id': 'ok-3'}], {'ok-3': 'd'})}, 'marker-3')
+        monkeypatch.setattr('ccib.threads.os._exit', fake_exit)
+        writer.start()
+        assert exited.wait(5)
+
+        assert codes == [1]
+        assert saved == ['marker-1']
+        assert coordinator.released
+        assert queue.qsize() == 1
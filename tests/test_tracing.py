@@ -0,0 +1,182 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from ccib.tracing import NOOP_TRACE, JsonlExporter, OtlpHttpExporter, Tracer
+
+
+class _ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+
+def test_disabled_tracer_never_samples():
+    tracer = Tracer(sample_rate=1.0)
+    assert tracer.start_trace() is NOOP_TRACE
+
+
+def test_zero_sample_rate_never_samples():
+    tracer = Tracer(_ListExporter(), sample_rate=0.0)
+    assert all(tracer.start_trace() is NOOP_TRACE for _ in range(100))
+
+
+def test_noop_trace_records_nothing():
+    with NOOP_TRACE.span('fetch') as span:
+        span.attributes['count'] = 1
+    assert not span.attributes
+    NOOP_TRACE.record('queue_wait', 0)
+
+
+def test_spans_share_trace_and_carry_marker():
+    exporter = _ListExporter()
+    tracer = Tracer(exporter, sample_rate=1.0)
+    trace = tracer.start_trace()
+    trace.marker = '1700000000.000:abc'
+    with trace.span('send', indicators=3) as parent:
+        with trace.span('chronicle_request', parent=parent, attempt=1):
+            pass
+    trace.record('queue_wait', parent.start_ns)
+    tracer.flush()
+
+    request, send, wait = exporter.spans
+    assert {span.trace_id for span in exporter.spans} == {trace.trace_id}
+    assert request.parent_id == send.span_id
+    assert send.attributes == {'indicators': 3, 'ccib.marker': '1700000000.000:abc'}
+    assert wait.name == 'queue_wait' and wait.end_ns >= wait.start_ns
+
+
+def test_span_records_error():
+    exporter = _ListExporter()
+    tracer = Tracer(exporter, sample_rate=1.0)
+    with pytest.raises(ValueError):
+        with tracer.start_trace().span('send'):
+            raise ValueError('boom')
+    tracer.flush()
+    assert exporter.spans[0].attributes['error'] == 'ValueError'
+
+
+def _wait_for(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_spans_are_batched():
+    exporter = _ListExporter()
+    tracer = Tracer(exporter, sample_rate=1.0)
+    tracer.BATCH_SIZE = 3
+    trace = tracer.start_trace()
+    for _ in range(2):
+        with trace.span('dedup'):
+            pass
+    time.sleep(0.1)
+    assert not exporter.spans
+    with trace.span('dedup'):
+        pass
+    assert _wait_for(lambda: len(exporter.spans) == 3)
+
+
+def test_slow_exporter_does_not_block_and_drops_when_full():
+    class _Blocking:
+        def __init__(self):
+            self.entered = threading.Event()
+            self.release = threading.Event()
+
+        def export(self, spans):
+            self.entered.set()
+            self.release.wait(5)
+
+    class _SmallTracer(Tracer):
+        MAX_QUEUED = 2
+
+    exporter = _Blocking()
+    tracer = _SmallTracer(exporter, sample_rate=1.0)
+    trace = tracer.start_trace()
+    with trace.span('fetch'):
+        pass
+    assert tracer.flush(timeout=0.01) is False
+    assert exporter.entered.wait(5)
+
+    started = time.monotonic()
+    for _ in range(10):
+        with trace.span('send'):
+            pass
+    assert time.monotonic() - started < 1
+    assert tracer.dropped == 8
+    exporter.release.set()
+    assert tracer.flush(timeout=5)
+
+
+def test_export_failure_is_logged_not_raised():
+    class _Failing:
+        def export(self, spans):
+            raise OSError('collector down')
+
+    tracer = Tracer(_Failing(), sample_rate=1.0)
+    with tracer.start_trace().span('fetch'):
+        pass
+    tracer.flush()
+
+
+def test_jsonl_exporter(tmp_path):
+    path = tmp_path / 'traces' / 'spans.jsonl'
+    tracer = Tracer(JsonlExporter(str(path)), sample_rate=1.0)
+    trace = tracer.start_trace()
+    trace.marker = 'm1'
+    with trace.span('fetch', indicators=10):
+        pass
+    tracer.flush()
+
+    line = json.loads(path.read_text().splitlines()[0])
+    assert line['name'] == 'fetch'
+    assert line['attributes'] == {'indicators': 10, 'ccib.marker': 'm1'}
+    assert line['duration_ms'] >= 0
+
+
+def test_otlp_exporter_rejects_non_http_endpoint():
+    with pytest.raises(ValueError):
+        OtlpHttpExporter('file:///etc/passwd')
+
+
+def test_otlp_exporter_posts_to_collector():
+    received = []
+
+    class _Collector(BaseHTTPRequestHandler):
+        def do_POST(self):  # pylint: disable=C0103
+            received.append((self.path, json.loads(self.rfile.read(int(self.headers['Content-Length'])))))
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+        def log_message(self, *args):  # pylint: disable=W0221
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), _Collector)
+    threading.Thread(target=server.handle_request, daemon=True).start()
+    try:
+        tracer = Tracer(OtlpHttpExporter(f'http://127.0.0.1:{server.server_port}/v1/traces'), sample_rate=1.0)
+        trace = tracer.start_trace()
+        trace.marker = 'm1'
+        with trace.span('send', indicators=2, bytes=1.5):
+            pass
+        tracer.flush()
+    finally:
+        server.server_close()
+
+    path, body = received[0]
+    assert path == '/v1/traces'
+    span = body['resourceSpans'][0]['scopeSpans'][0]['spans'][0]
+    assert span['traceId'] == trace.trace_id and len(span['traceId']) == 32
+    assert span['name'] == 'send'
+    assert {'key': 'indicators', 'value': {'intValue': '2'}} in span['attributes']
+    assert {'key': 'bytes', 'value': {'doubleValue': 1.5}} in span['attributes']
+    assert {'key': 'ccib.marker', 'value': {'stringValue': 'm1'}} in span['attributes']